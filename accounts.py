@@ -0,0 +1,145 @@
+import os
+import time
+import zlib
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACCOUNT_ID = "default"
+
+# Per-account budgets, so one busy account can't starve the others sharing the process
+ACCOUNT_MAX_CONCURRENCY = int(os.environ.get("ACCOUNT_MAX_CONCURRENCY", 2))
+ACCOUNT_COMMANDS_PER_MINUTE = int(os.environ.get("ACCOUNT_COMMANDS_PER_MINUTE", 20))
+
+# How often the host's maintenance loop compacts rollups and archives aged history
+MAINTENANCE_INTERVAL_SECONDS = 3600
+
+
+def load_accounts():
+    """
+    Read the hosted accounts from the environment as {account_id: session_string}.
+
+    TELEGRAM_SESSION_STRINGS holds comma-separated `name:session_string` pairs.
+    A lone TELEGRAM_SESSION_STRING is still honoured as the "default" account.
+    """
+    accounts = {}
+    for entry in os.environ.get("TELEGRAM_SESSION_STRINGS", "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        account_id, separator, session_string = entry.partition(":")
+        if not separator or not account_id.strip() or not session_string.strip():
+            logger.warning("Ignoring malformed TELEGRAM_SESSION_STRINGS entry (expected name:session_string)")
+            continue
+        accounts[account_id.strip()] = session_string.strip()
+
+    single_session = os.environ.get("TELEGRAM_SESSION_STRING")
+    if single_session and DEFAULT_ACCOUNT_ID not in accounts:
+        accounts[DEFAULT_ACCOUNT_ID] = single_session
+    return accounts
+
+
+def shard_accounts(accounts: dict, shard_index: int = 0, shard_count: int = 1):
+    """Return the subset of accounts owned by one shard, using a stable hash of the account id."""
+    if shard_count <= 1:
+        return dict(accounts)
+    return {
+        account_id: session_string
+        for account_id, session_string in accounts.items()
+        if zlib.crc32(account_id.encode("utf-8")) % shard_count == shard_index
+    }
+
+
+class AccountBudget:
+    """
+    Concurrency cap plus token-bucket rate limit for one account.
+
+    Used as `async with budget:` around each command; waits rather than
+    rejecting when the account is over budget.
+    """
+
+    def __init__(self, max_concurrency: int = ACCOUNT_MAX_CONCURRENCY,
+                 per_minute: int = ACCOUNT_COMMANDS_PER_MINUTE):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.capacity = max(per_minute, 1)
+        self.tokens = float(self.capacity)
+        self.refill_rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def _take_token(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+    async def __aenter__(self):
+        await self._take_token()
+        await self.semaphore.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+        return False
+
+
+class MultiAccountHost:
+    """Runs one UserbotManager per account on a single event loop with a shared Gemini client."""
+
+    def __init__(self, accounts: dict = None, shard_index: int = 0, shard_count: int = 1):
+        from userbot import UserbotManager
+        from gemini_client import GeminiClient
+
+        accounts = load_accounts() if accounts is None else accounts
+        self.accounts = shard_accounts(accounts, shard_index, shard_count)
+        self.shard_index = shard_index
+        self.gemini = GeminiClient()
+        self.managers = {
+            account_id: UserbotManager(
+                account_id=account_id,
+                session_string=session_string,
+                gemini=self.gemini,
+                budget=AccountBudget(),
+            )
+            for account_id, session_string in self.accounts.items()
+        }
+
+    @property
+    def is_running(self):
+        return any(manager.is_running for manager in self.managers.values())
+
+    @is_running.setter
+    def is_running(self, value):
+        for manager in self.managers.values():
+            manager.is_running = value
+
+    async def start(self):
+        """Start every hosted account; one failing account doesn't stop the others."""
+        if not self.managers:
+            logger.error("No Telegram accounts configured for this shard")
+            return
+        logger.info(f"Starting {len(self.managers)} account(s): {', '.join(self.managers)}")
+        # Only the first shard runs maintenance, so sharded workers don't race on the same rows
+        maintenance = asyncio.create_task(self.run_maintenance()) if self.shard_index == 0 else None
+        try:
+            await asyncio.gather(*(manager.start() for manager in self.managers.values()))
+        finally:
+            if maintenance:
+                maintenance.cancel()
+
+    async def run_maintenance(self):
+        """Periodically compact analytics rollups and archive aged history off the event loop."""
+        from analytics import compact_rollups
+        from utils import clean_old_data
+
+        loop = asyncio.get_event_loop()
+        while True:
+            await loop.run_in_executor(None, compact_rollups)
+            await loop.run_in_executor(None, clean_old_data)
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
@@ -0,0 +1,187 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from app import app, db
+from models import ChatActivityRollup, CommandUsageRollup
+
+logger = logging.getLogger(__name__)
+
+# Hourly buckets older than this are merged into daily buckets by compact_rollups()
+HOURLY_RETENTION_DAYS = 7
+
+
+def _hour_bucket(timestamp: datetime):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def record_messages_bulk(entries):
+    """
+    Bump hourly activity counters for many messages at once.
+
+    `entries` yields (account_id, chat_id, user_id, display_name, timestamp) tuples. Counts
+    are pre-aggregated per bucket because a multi-row ON CONFLICT DO UPDATE
+    can't touch the same row twice. Executes on the current db.session without
+    committing, so callers fold it into the ChatHistory write's transaction.
+    """
+    buckets = {}
+    for account_id, chat_id, user_id, display_name, timestamp in entries:
+        key = (account_id, chat_id, user_id or 0, _hour_bucket(timestamp))
+        count, name = buckets.get(key, (0, None))
+        buckets[key] = (count + 1, display_name or name)
+    if not buckets:
+        return
+
+    stmt = insert(ChatActivityRollup).values([
+        {
+            'account_id': account_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'display_name': name,
+            'granularity': 'hour',
+            'bucket_start': bucket_start,
+            'message_count': count,
+        }
+        for (account_id, chat_id, user_id, bucket_start), (count, name) in buckets.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_chat_activity_bucket',
+        set_={
+            'message_count': ChatActivityRollup.message_count + stmt.excluded.message_count,
+            'display_name': func.coalesce(stmt.excluded.display_name, ChatActivityRollup.display_name),
+        },
+    )
+    db.session.execute(stmt)
+
+
+def record_command(account_id: str, chat_id: int, command: str, timestamp: datetime = None):
+    """Bump the hourly usage counter for an account's command and commit it."""
+    try:
+        with app.app_context():
+            stmt = insert(CommandUsageRollup).values(
+                account_id=account_id,
+                command=command,
+                chat_id=chat_id,
+                granularity='hour',
+                bucket_start=_hour_bucket(timestamp or datetime.utcnow()),
+                use_count=1,
+            )
+            stmt = stmt.on_conflict_do_update(
+                constraint='uq_command_usage_bucket',
+                set_={'use_count': CommandUsageRollup.use_count + stmt.excluded.use_count},
+            )
+            db.session.execute(stmt)
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Error recording command usage: {e}")
+
+
+def _compact_table(model, constraint: str, key_columns, counter_column, cutoff: datetime):
+    """
+    Move hourly rows older than cutoff into daily rows.
+
+    Delete and merge are one statement (DELETE ... RETURNING feeding the
+    INSERT), so an hourly row written concurrently, e.g. by a backfill, is
+    either moved with the rest or left for the next run, never dropped.
+    """
+    extra_names = ['display_name'] if model is ChatActivityRollup else []
+    moved = delete(model).where(
+        model.granularity == 'hour',
+        model.bucket_start < cutoff,
+    ).returning(
+        *[getattr(model, name) for name in key_columns + extra_names],
+        model.bucket_start,
+        getattr(model, counter_column),
+    ).cte('moved')
+
+    day_bucket = func.date_trunc('day', moved.c.bucket_start)
+    key_moved = [moved.c[name] for name in key_columns]
+    aggregated = select(
+        *key_moved,
+        *[func.max(moved.c[name]) for name in extra_names],
+        literal('day'),
+        day_bucket,
+        func.sum(moved.c[counter_column]),
+    ).group_by(*key_moved, day_bucket)
+
+    stmt = insert(model).from_select(
+        [*key_columns, *extra_names, 'granularity', 'bucket_start', counter_column],
+        aggregated,
+    )
+    set_ = {counter_column: getattr(model, counter_column) + getattr(stmt.excluded, counter_column)}
+    if extra_names:
+        set_['display_name'] = func.coalesce(stmt.excluded.display_name, model.display_name)
+    stmt = stmt.on_conflict_do_update(constraint=constraint, set_=set_)
+    return db.session.execute(stmt).rowcount
+
+
+def compact_rollups(older_than_days: int = HOURLY_RETENTION_DAYS):
+    """Fold hourly rollup buckets older than `older_than_days` into daily buckets."""
+    try:
+        with app.app_context():
+            cutoff = _hour_bucket(datetime.utcnow() - timedelta(days=older_than_days)).replace(hour=0)
+            merged_activity = _compact_table(ChatActivityRollup, 'uq_chat_activity_bucket', ['account_id', 'chat_id', 'user_id'], 'message_count', cutoff)
+            merged_commands = _compact_table(CommandUsageRollup, 'uq_command_usage_bucket', ['account_id', 'command', 'chat_id'], 'use_count', cutoff)
+            db.session.commit()
+            logger.info(f"Compacted hourly buckets into {merged_activity} activity and {merged_commands} command daily buckets")
+    except Exception as e:
+        logger.error(f"Rollup compaction error: {e}")
+
+
+def get_activity_summary(chat_id: int = None, days: int = 7, top_n: int = 10, account_id: str = None):
+    """Read-only analytics over the rollup tables for the dashboard API, optionally for one account."""
+    since = _hour_bucket(datetime.utcnow() - timedelta(days=days)).replace(hour=0)
+
+    activity_filters = [ChatActivityRollup.bucket_start >= since]
+    command_filters = [CommandUsageRollup.bucket_start >= since]
+    if chat_id is not None:
+        activity_filters.append(ChatActivityRollup.chat_id == chat_id)
+        command_filters.append(CommandUsageRollup.chat_id == chat_id)
+    if account_id is not None:
+        activity_filters.append(ChatActivityRollup.account_id == account_id)
+        command_filters.append(CommandUsageRollup.account_id == account_id)
+
+    with app.app_context():
+        volume_rows = db.session.query(
+            ChatActivityRollup.chat_id,
+            ChatActivityRollup.granularity,
+            ChatActivityRollup.bucket_start,
+            func.sum(ChatActivityRollup.message_count),
+        ).filter(*activity_filters).group_by(
+            ChatActivityRollup.chat_id,
+            ChatActivityRollup.granularity,
+            ChatActivityRollup.bucket_start,
+        ).order_by(ChatActivityRollup.bucket_start).all()
+
+        sender_total = func.sum(ChatActivityRollup.message_count)
+        sender_rows = db.session.query(
+            ChatActivityRollup.user_id,
+            func.max(ChatActivityRollup.display_name),
+            sender_total,
+        ).filter(*activity_filters).group_by(
+            ChatActivityRollup.user_id
+        ).order_by(sender_total.desc()).limit(top_n).all()
+
+        command_total = func.sum(CommandUsageRollup.use_count)
+        command_rows = db.session.query(
+            CommandUsageRollup.command,
+            command_total,
+        ).filter(*command_filters).group_by(
+            CommandUsageRollup.command
+        ).order_by(command_total.desc()).all()
+
+    return {
+        "since": since.isoformat(),
+        "message_volume": [
+            {"chat_id": row[0], "granularity": row[1], "bucket_start": row[2].isoformat(), "messages": int(row[3])}
+            for row in volume_rows
+        ],
+        "top_senders": [
+            {"user_id": row[0], "name": row[1] or f"User_{row[0]}", "messages": int(row[2])}
+            for row in sender_rows
+        ],
+        "command_usage": [
+            {"command": row[0], "uses": int(row[1])}
+            for row in command_rows
+        ],
+    }
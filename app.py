@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 import os
+import hmac
 import logging
 import threading
 import time
 import asyncio
 import sys
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -63,11 +64,12 @@ def status():
     bot_name = "Envo AI Userbot"
     powered_by = "Envologia"
 
-    session_string = os.environ.get("TELEGRAM_SESSION_STRING")
+    from accounts import load_accounts
+    accounts = load_accounts()
     gemini_key = os.environ.get("GEMINI_API_KEY")
 
-    if not session_string or not gemini_key:
-        error_msg = "Telegram session string" if not session_string else "Gemini API key"
+    if not accounts or not gemini_key:
+        error_msg = "Telegram session string" if not accounts else "Gemini API key"
         return jsonify({
             "status": "missing_credentials",
             "error": f"{error_msg} is not configured.",
@@ -83,6 +85,7 @@ def status():
             "status": "running",
             "bot_name": bot_name,
             "powered_by": powered_by,
+            "accounts": sorted(account_id for account_id, account in manager.managers.items() if account.is_running),
             "message": "Userbot is running! Commands are active in Telegram."
         })
     elif thread and thread.is_alive():
@@ -120,14 +123,21 @@ def start_userbot_endpoint():
         logger.info("New event loop created for the userbot thread.")
 
         try:
-            from userbot import UserbotManager
+            import startup
+            from accounts import MultiAccountHost
             
-            # 2. Initialize the manager and store it in the global state
-            manager = UserbotManager()
+            # Don't let handlers hit tables the schema step hasn't created yet
+            startup.wait_for_schema()
+            
+            # 2. Initialize the host (one client per configured account) and store it in the global state
+            manager = MultiAccountHost(
+                shard_index=int(os.environ.get("SHARD_INDEX", 0)),
+                shard_count=int(os.environ.get("SHARD_COUNT", 1)),
+            )
             userbot_state["manager"] = manager
             
             # 3. Run the userbot's main async start function
-            logger.info("Starting UserbotManager...")
+            logger.info("Starting MultiAccountHost...")
             loop.run_until_complete(manager.start())
 
         except Exception as e:
@@ -156,26 +166,102 @@ def start_userbot_endpoint():
         logger.error(f"Failed to start userbot thread from endpoint: {e}", exc_info=True)
         return jsonify({"status": "error", "error": f"Failed to create userbot thread: {e}"})
 
+def has_valid_export_token():
+    """True when the request carries EXPORT_TOKEN in the X-Export-Token header."""
+    export_token = os.environ.get("EXPORT_TOKEN")
+    supplied_token = request.headers.get("X-Export-Token", "")
+    return bool(export_token) and hmac.compare_digest(supplied_token.encode("utf-8"), export_token.encode("utf-8"))
+
+@app.route('/export/chat_history')
+def export_chat_history():
+    """
+    Streams ChatHistory as NDJSON (default) or CSV.
+
+    Query params: chat_id (omit for all chats), account_id (omit for all
+    accounts), format=ndjson|csv, since_id (resume after this row id),
+    gzip=1. Requires the EXPORT_TOKEN
+    to be sent in the X-Export-Token header.
+    """
+    if not has_valid_export_token():
+        return jsonify({"status": "forbidden", "error": "A valid export token is required."}), 403
+
+    fmt = request.args.get("format", "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"status": "error", "error": "format must be 'ndjson' or 'csv'."}), 400
+
+    try:
+        chat_id = int(request.args["chat_id"]) if request.args.get("chat_id") else None
+        since_id = int(request.args["since_id"]) if request.args.get("since_id") else None
+    except ValueError:
+        return jsonify({"status": "error", "error": "chat_id and since_id must be integers."}), 400
+    compress = request.args.get("gzip", "0").lower() in ("1", "true", "yes")
+    account_id = request.args.get("account_id") or None
+
+    from exporter import stream_chat_history
+
+    headers = {
+        "Content-Disposition": f"attachment; filename=chat_history_{chat_id or 'all'}.{fmt}{'.gz' if compress else ''}",
+        "X-Accel-Buffering": "no",  # Don't let reverse proxies buffer the whole stream
+    }
+    if compress:
+        # A .gz file download, not a transfer encoding: clients keep the bytes compressed
+        mimetype = "application/gzip"
+    else:
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+
+    return Response(
+        stream_chat_history(db.engine, fmt=fmt, chat_id=chat_id, since_id=since_id, compress=compress, account_id=account_id),
+        mimetype=mimetype,
+        headers=headers,
+    )
+
+@app.route('/api/analytics')
+def analytics_api():
+    """
+    Chat activity, top senders and command usage, read from the rollup tables only.
+    Exposes sender names and ids, so it requires the EXPORT_TOKEN like the export.
+    """
+    if not has_valid_export_token():
+        return jsonify({"status": "forbidden", "error": "A valid export token is required."}), 403
+
+    try:
+        chat_id = int(request.args["chat_id"]) if request.args.get("chat_id") else None
+        days = min(max(int(request.args.get("days", 7)), 1), 365)
+    except ValueError:
+        return jsonify({"status": "error", "error": "chat_id and days must be integers."}), 400
+    account_id = request.args.get("account_id") or None
+
+    try:
+        from analytics import get_activity_summary
+        return jsonify({"status": "ok", **get_activity_summary(chat_id=chat_id, days=days, account_id=account_id)})
+    except Exception as e:
+        logger.error(f"Analytics query failed: {e}", exc_info=True)
+        return jsonify({"status": "error", "error": "Analytics are unavailable right now."}), 500
+
+@app.route('/api/startup')
+def startup_api():
+    """Startup timing report: boot phases, slowest imports and lazily loaded plugins."""
+    import startup
+    return jsonify({"status": "ok", **startup.startup_report()})
+
 # --- Application Initialization Logic ---
 def initialize_database():
     """
-    Creates all database tables defined in the models.
-    This should be called within the app context.
+    Creates missing tables and applies pending migrations.
+    Called once per process by the startup sequence (startup.run_startup), not on import.
     """
     with app.app_context():
-        logger.info("Initializing database and creating tables...")
+        logger.info("Checking database schema...")
         try:
-            # Import models here to ensure they are registered with SQLAlchemy
-            import models
-            db.create_all()
-            logger.info("Database tables checked/created successfully.")
+            from migrations import run_migrations
+            run_migrations()
+            logger.info("Database schema is up to date.")
         except Exception as e:
             logger.error(f"Error during database initialization: {e}", exc_info=True)
 
-# Run the database initialization when the application starts
-initialize_database()
-
 if __name__ == '__main__':
+    import startup
+    startup.run_startup()
     # Use the PORT environment variable provided by Render
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,435 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import functools
+import threading
+from array import array
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from sqlalchemy import BigInteger, Boolean, DateTime, Integer, func
+from app import app, db
+from models import ChatHistory
+from accounts import DEFAULT_ACCOUNT_ID
+
+logger = logging.getLogger(__name__)
+
+# Root directory for cold segments: <ARCHIVE_DIR>/<account_id>/<chat_id>/<YYYY-MM>.<n>.seg.
+# Archiving deletes rows from Postgres, so it is off unless this points at durable
+# storage (e.g. a mounted persistent disk); an ephemeral container filesystem would lose them.
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")
+# ChatHistory rows older than this are moved out of Postgres into segments
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+# Rows deleted from the hot table per statement once archived
+ARCHIVE_DELETE_BATCH = 1000
+
+SEGMENT_MAGIC = b"ENVOSEG1"
+INDEX_FILE = "index.json"
+# Per-chat set of archived message ids deleted on Telegram after they were archived
+DELETED_FILE = "deleted.json"
+NULL_INT = -(2 ** 63)  # sentinel for NULL in integer columns
+EPOCH = datetime(1970, 1, 1)
+
+# Every ChatHistory column except the ones implied by the segment's location
+SEGMENT_COLUMNS = [
+    column for column in ChatHistory.__table__.columns
+    if column.name not in ("id", "account_id", "chat_id")
+]
+
+
+def _column_kind(column):
+    if isinstance(column.type, DateTime):
+        return "ts"
+    if isinstance(column.type, Boolean):
+        return "bool"
+    if isinstance(column.type, (BigInteger, Integer)):
+        return "int"
+    return "str"
+
+
+# --- Encoding ---
+
+def _encode_ints(values):
+    return array("q", (NULL_INT if value is None else int(value) for value in values)).tobytes()
+
+
+def _decode_ints(data: bytes):
+    return [None if value == NULL_INT else value for value in array("q", data)]
+
+
+def _encode_timestamps(values):
+    return _encode_ints(
+        None if value is None else (value - EPOCH) // timedelta(microseconds=1) for value in values
+    )
+
+
+def _decode_timestamps(data: bytes):
+    return [None if value is None else EPOCH + timedelta(microseconds=value) for value in _decode_ints(data)]
+
+
+def _encode_strings(values):
+    """Length-prefixed layout: uint32 count, int32 lengths (-1 = NULL), then the concatenated UTF-8 bytes."""
+    encoded = [None if value is None else str(value).encode("utf-8") for value in values]
+    lengths = array("i", (-1 if value is None else len(value) for value in encoded))
+    return struct.pack("<I", len(encoded)) + lengths.tobytes() + b"".join(value for value in encoded if value)
+
+
+def _decode_strings(data: bytes):
+    (count,) = struct.unpack_from("<I", data)
+    lengths = array("i")
+    lengths.frombytes(data[4:4 + 4 * count])
+    values, position = [], 4 + 4 * count
+    for length in lengths:
+        if length < 0:
+            values.append(None)
+            continue
+        values.append(data[position:position + length].decode("utf-8"))
+        position += length
+    return values
+
+
+def _decode_bools(data: bytes):
+    return [None if value is None else bool(value) for value in _decode_ints(data)]
+
+
+_ENCODERS = {"int": _encode_ints, "bool": _encode_ints, "ts": _encode_timestamps, "str": _encode_strings}
+_DECODERS = {"int": _decode_ints, "bool": _decode_bools, "ts": _decode_timestamps, "str": _decode_strings}
+
+
+# --- Segment files ---
+
+def write_segment(path: str, rows):
+    """
+    Write rows (dicts keyed by column name) as a columnar segment.
+
+    Layout: magic, uint32 header length, JSON header describing each
+    column's kind/offset/length, then one zlib-compressed block per column.
+    Readers only decompress the columns they ask for.
+    """
+    blocks, columns, offset = [], {}, 0
+    for column in SEGMENT_COLUMNS:
+        kind = _column_kind(column)
+        block = zlib.compress(_ENCODERS[kind]([row[column.name] for row in rows]), 6)
+        columns[column.name] = {"kind": kind, "offset": offset, "length": len(block)}
+        blocks.append(block)
+        offset += len(block)
+
+    header = json.dumps({"rows": len(rows), "columns": columns}).encode("utf-8")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SEGMENT_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+
+
+@functools.lru_cache(maxsize=64)
+def _read_column(path: str, mtime: float, name: str):
+    """Decode one column of a segment via mmap; cached per (file version, column)."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"Not an archive segment: {path}")
+        (header_length,) = struct.unpack_from("<I", mm, len(SEGMENT_MAGIC))
+        data_start = len(SEGMENT_MAGIC) + 4 + header_length
+        header = json.loads(mm[len(SEGMENT_MAGIC) + 4:data_start])
+        column = header["columns"].get(name)
+        if column is None:
+            # Column added after this segment was written
+            return [None] * header["rows"]
+        start = data_start + column["offset"]
+        return _DECODERS[column["kind"]](zlib.decompress(mm[start:start + column["length"]]))
+
+
+def read_segment_columns(path: str, names):
+    mtime = os.path.getmtime(path)
+    return {name: _read_column(path, mtime, name) for name in names}
+
+
+# --- Sidecar index ---
+
+def _chat_dir(account_id: str, chat_id: int):
+    return os.path.join(ARCHIVE_DIR, account_id or DEFAULT_ACCOUNT_ID, str(chat_id))
+
+
+def load_index(account_id: str, chat_id: int):
+    """Segment metadata for one chat: file, month, rows, time and message_id ranges."""
+    if not ARCHIVE_DIR:
+        return []
+    path = os.path.join(_chat_dir(account_id, chat_id), INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["segments"]
+
+
+def _save_index(account_id: str, chat_id: int, segments):
+    path = os.path.join(_chat_dir(account_id, chat_id), INDEX_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"segments": segments}, f)
+    os.replace(tmp_path, path)
+
+
+def archived_chat_ids(account_id: str):
+    """Chats of an account that have an archive directory."""
+    if not ARCHIVE_DIR:
+        return []
+    account_dir = os.path.join(ARCHIVE_DIR, account_id or DEFAULT_ACCOUNT_ID)
+    if not os.path.isdir(account_dir):
+        return []
+    chat_ids = []
+    for name in os.listdir(account_dir):
+        try:
+            chat_ids.append(int(name))
+        except ValueError:
+            continue
+    return chat_ids
+
+
+# --- Tombstones ---
+
+_tombstone_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=64)
+def _read_tombstones(path: str, mtime: float):
+    with open(path, "r", encoding="utf-8") as f:
+        return frozenset(json.load(f)["message_ids"])
+
+
+def deleted_message_ids(account_id: str, chat_id: int):
+    """Archived message ids of a chat that have since been deleted."""
+    if not ARCHIVE_DIR:
+        return frozenset()
+    path = os.path.join(_chat_dir(account_id, chat_id), DELETED_FILE)
+    if not os.path.exists(path):
+        return frozenset()
+    return _read_tombstones(path, os.path.getmtime(path))
+
+
+def record_archived_deletions(account_id: str, chat_ids, message_ids):
+    """
+    Tombstone deleted messages that only exist in segments, so archive reads skip them.
+
+    Segments are immutable; deletions are kept in a per-chat set next to the
+    index instead. Returns how many archived messages were newly tombstoned.
+    """
+    if not ARCHIVE_DIR or not message_ids:
+        return 0
+    recorded = 0
+    with _tombstone_lock:
+        for chat_id in chat_ids:
+            found = archived_message_ids(account_id, chat_id, message_ids)
+            existing = deleted_message_ids(account_id, chat_id)
+            new = found - existing
+            if not new:
+                continue
+            path = os.path.join(_chat_dir(account_id, chat_id), DELETED_FILE)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"message_ids": sorted(existing | new)}, f)
+            os.replace(tmp_path, path)
+            recorded += len(new)
+    return recorded
+
+
+# --- Archiving ---
+
+def _archive_group(account_id: str, chat_id: int, month_start: datetime, cutoff: datetime):
+    """Move one chat-month of aged rows into a new segment, then delete them from the hot table."""
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+    rows = db.session.query(ChatHistory).filter(
+        ChatHistory.account_id == account_id,
+        ChatHistory.chat_id == chat_id,
+        ChatHistory.timestamp >= month_start,
+        ChatHistory.timestamp < min(month_end, cutoff),
+    ).order_by(ChatHistory.timestamp, ChatHistory.message_id).all()
+    if not rows:
+        return 0
+
+    # Deleted messages are dropped from the hot table without being archived
+    kept = [row for row in rows if not row.is_deleted]
+    ids = [row.id for row in rows]
+    if kept:
+        _write_archived_rows(account_id, chat_id, month_start, kept)
+
+    # Only delete what was read, so rows that arrived meanwhile are kept
+    for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+        ChatHistory.query.filter(
+            ChatHistory.id.in_(ids[start:start + ARCHIVE_DELETE_BATCH])
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return len(kept)
+
+
+def _write_archived_rows(account_id: str, chat_id: int, month_start: datetime, rows):
+    """Write rows as the next segment of their chat-month and register it in the index."""
+    chat_dir = _chat_dir(account_id, chat_id)
+    os.makedirs(chat_dir, exist_ok=True)
+    segments = load_index(account_id, chat_id)
+    month = month_start.strftime("%Y-%m")
+    sequence = sum(1 for segment in segments if segment["month"] == month)
+    file_name = f"{month}.{sequence}.seg"
+
+    write_segment(
+        os.path.join(chat_dir, file_name),
+        [{column.name: getattr(row, column.name) for column in SEGMENT_COLUMNS} for row in rows],
+    )
+    segments.append({
+        "file": file_name,
+        "month": month,
+        "rows": len(rows),
+        "min_timestamp": rows[0].timestamp.isoformat(),
+        "max_timestamp": rows[-1].timestamp.isoformat(),
+        "min_message_id": min(row.message_id for row in rows),
+        "max_message_id": max(row.message_id for row in rows),
+    })
+    _save_index(account_id, chat_id, segments)
+
+
+def archive_old_history(older_than_days: int = ARCHIVE_AFTER_DAYS):
+    """Archive every chat-month of ChatHistory older than `older_than_days`. Returns rows moved."""
+    if not ARCHIVE_DIR:
+        logger.debug("ARCHIVE_DIR is not set; chat history stays in Postgres")
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with app.app_context():
+        month = func.date_trunc('month', ChatHistory.timestamp)
+        groups = db.session.query(
+            ChatHistory.account_id, ChatHistory.chat_id, month
+        ).filter(ChatHistory.timestamp < cutoff).group_by(
+            ChatHistory.account_id, ChatHistory.chat_id, month
+        ).all()
+
+        archived = 0
+        for account_id, chat_id, month_start in groups:
+            try:
+                archived += _archive_group(account_id, chat_id, month_start, cutoff)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to archive chat {account_id}/{chat_id} {month_start:%Y-%m}: {e}", exc_info=True)
+        if archived:
+            logger.info(f"Archived {archived} chat history rows older than {older_than_days} days")
+        return archived
+
+
+# --- Reading ---
+
+@functools.lru_cache(maxsize=64)
+def _segment_message_ids(path: str, mtime: float):
+    return frozenset(_read_column(path, mtime, "message_id"))
+
+
+def archived_message_ids(account_id: str, chat_id: int, message_ids):
+    """The subset of `message_ids` already stored in this chat's segments."""
+    found = set()
+    for segment in load_index(account_id, chat_id):
+        # The index's id range rules out most segments (and all new messages) without opening files
+        candidates = {
+            message_id for message_id in message_ids
+            if segment["min_message_id"] <= message_id <= segment["max_message_id"]
+        }
+        if candidates:
+            path = os.path.join(_chat_dir(account_id, chat_id), segment["file"])
+            found |= candidates & _segment_message_ids(path, os.path.getmtime(path))
+    return found
+
+
+def drop_archived_rows(rows):
+    """
+    Filter out ChatHistory row dicts whose message has already been archived.
+
+    Archived messages are gone from the hot table, so its unique index can't
+    stop a backfill or redelivery from storing them a second time.
+    """
+    if not ARCHIVE_DIR or not rows:
+        return rows
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault((row["account_id"], row["chat_id"]), []).append(row["message_id"])
+    archived = {
+        (account_id, chat_id, message_id)
+        for (account_id, chat_id), message_ids in by_chat.items()
+        for message_id in archived_message_ids(account_id, chat_id, message_ids)
+    }
+    if not archived:
+        return rows
+    logger.info(f"Skipping {len(archived)} already archived chat history rows")
+    return [row for row in rows if (row["account_id"], row["chat_id"], row["message_id"]) not in archived]
+
+
+def _segments_newest_first(account_id: str, chat_id: int, before: datetime = None):
+    segments = sorted(load_index(account_id, chat_id), key=lambda segment: segment["max_timestamp"], reverse=True)
+    if before is not None:
+        # Skip segments that start at or after `before` without opening them
+        segments = [segment for segment in segments if segment["min_timestamp"] < before.isoformat()]
+    return segments
+
+
+def _rows_from_columns(columns, indexes, chat_id: int, account_id: str):
+    return [
+        SimpleNamespace(
+            account_id=account_id,
+            chat_id=chat_id,
+            **{name: values[i] for name, values in columns.items()},
+        )
+        for i in indexes
+    ]
+
+
+def read_recent_archived(chat_id: int, limit: int, account_id: str = None, before: datetime = None):
+    """Newest archived messages of a chat (older than `before`), newest first, as ChatHistory-like objects."""
+    account_id = account_id or DEFAULT_ACCOUNT_ID
+    names = [column.name for column in SEGMENT_COLUMNS]
+    results, seen = [], set()
+    tombstones = deleted_message_ids(account_id, chat_id)
+    for segment in _segments_newest_first(account_id, chat_id, before):
+        path = os.path.join(_chat_dir(account_id, chat_id), segment["file"])
+        columns = read_segment_columns(path, names)
+        timestamps = columns["timestamp"]
+        deleted = columns["is_deleted"]
+        # Same filters as the hot context queries: text rows that aren't deleted
+        indexes = [
+            i for i in sorted(range(len(timestamps)), key=timestamps.__getitem__, reverse=True)
+            if (before is None or timestamps[i] < before)
+            and not deleted[i]
+            and columns["message_text"][i] is not None
+            and columns["message_id"][i] not in seen
+            and columns["message_id"][i] not in tombstones
+        ]
+        for row in _rows_from_columns(columns, indexes, chat_id, account_id):
+            seen.add(row.message_id)
+            results.append(row)
+            if len(results) >= limit:
+                return results
+    return results
+
+
+def search_archive(chat_id: int, term: str, limit: int, account_id: str = None):
+    """Case-insensitive substring search over archived text, newest segments first."""
+    account_id = account_id or DEFAULT_ACCOUNT_ID
+    needle = term.lower()
+    names = [column.name for column in SEGMENT_COLUMNS]
+    results, seen = [], set()
+    tombstones = deleted_message_ids(account_id, chat_id)
+    for segment in _segments_newest_first(account_id, chat_id):
+        path = os.path.join(_chat_dir(account_id, chat_id), segment["file"])
+        # Scan the text column alone; the rest is decoded only when something matches
+        texts = read_segment_columns(path, ["message_text"])["message_text"]
+        matches = [i for i, text in enumerate(texts) if text and needle in text.lower()]
+        if not matches:
+            continue
+        columns = read_segment_columns(path, names)
+        matches.sort(key=columns["timestamp"].__getitem__, reverse=True)
+        for row in _rows_from_columns(columns, matches, chat_id, account_id):
+            if row.message_id in seen or row.is_deleted or row.message_id in tombstones:
+                continue
+            seen.add(row.message_id)
+            results.append(row)
+            if len(results) >= limit:
+                return results
+    return results
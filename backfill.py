@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Backfill existing Telegram history into ChatHistory.
+
+Pages backwards through each chat with get_chat_history, bulk-inserts the
+messages (skipping ones already stored) and checkpoints progress per chat so
+an interrupted run picks up where it stopped.
+
+Usage:
+    python backfill.py CHAT [CHAT ...] [--account NAME] [--limit N] [--concurrency N] [--restart]
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from app import app, db
+from models import BackfillCheckpoint
+from ingest import history_row_from_message, insert_history_rows
+from accounts import DEFAULT_ACCOUNT_ID, load_accounts
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per chat before each bulk insert + checkpoint
+BACKFILL_BATCH_SIZE = 500
+# Chats paged at the same time; get_chat_history issues one request per 100 messages
+BACKFILL_CONCURRENCY = 3
+# Pause between batches of a chat, to stay well under Telegram's flood limits
+BACKFILL_BATCH_DELAY = 1.0
+
+
+def _load_checkpoint(account_id: str, chat_id: int, restart: bool = False):
+    with app.app_context():
+        checkpoint = db.session.get(BackfillCheckpoint, (account_id, chat_id))
+        if checkpoint is None:
+            checkpoint = BackfillCheckpoint(account_id=account_id, chat_id=chat_id, rows_inserted=0, completed=False)
+            db.session.add(checkpoint)
+        elif restart:
+            checkpoint.oldest_message_id = None
+            checkpoint.rows_inserted = 0
+            checkpoint.completed = False
+        db.session.commit()
+        return checkpoint.oldest_message_id, checkpoint.rows_inserted, checkpoint.completed
+
+
+def _save_checkpoint(account_id: str, chat_id: int, oldest_message_id: int, rows_inserted: int, completed: bool):
+    with app.app_context():
+        checkpoint = db.session.get(BackfillCheckpoint, (account_id, chat_id))
+        checkpoint.oldest_message_id = oldest_message_id
+        checkpoint.rows_inserted = rows_inserted
+        checkpoint.completed = completed
+        db.session.commit()
+
+
+def _should_store(message):
+    """
+    Mirror live ingestion (`~filters.me & ~filters.bot` plus store_chat_history):
+    skip own and bot messages and commands. Service messages are kept, stored
+    with message_type 'service' as the live handler does.
+    """
+    if message.empty or message.outgoing:
+        return False
+    if message.from_user and (message.from_user.is_self or message.from_user.is_bot):
+        return False
+    if message.text and message.text.startswith('.'):
+        return False
+    return True
+
+
+class Backfiller:
+    def __init__(self, client: Client, account_id: str = DEFAULT_ACCOUNT_ID, concurrency: int = BACKFILL_CONCURRENCY,
+                 batch_size: int = BACKFILL_BATCH_SIZE, limit: int = 0):
+        self.client = client
+        self.account_id = account_id
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.limit = limit  # max messages scanned per chat in this run, 0 = everything
+        self.total_inserted = 0
+
+    async def _flush(self, chat_id: int, rows, oldest_message_id: int, rows_inserted: int, completed: bool):
+        loop = asyncio.get_event_loop()
+        inserted = await loop.run_in_executor(None, insert_history_rows, rows)
+        rows_inserted += inserted
+        self.total_inserted += inserted
+        await loop.run_in_executor(None, _save_checkpoint, self.account_id, chat_id, oldest_message_id, rows_inserted, completed)
+        return rows_inserted
+
+    async def backfill_chat(self, chat_ref, restart: bool = False):
+        """Backfill one chat (id or username), resuming from its checkpoint."""
+        async with self.semaphore:
+            chat = await self.client.get_chat(chat_ref)
+            loop = asyncio.get_event_loop()
+            offset_id, rows_inserted, completed = await loop.run_in_executor(None, _load_checkpoint, self.account_id, chat.id, restart)
+            if completed:
+                logger.info(f"Chat {chat.id} already backfilled ({rows_inserted} rows), skipping")
+                return
+
+            started = time.monotonic()
+            scanned = 0
+            rows = []
+            while True:
+                try:
+                    async for message in self.client.get_chat_history(chat.id, offset_id=offset_id or 0):
+                        scanned += 1
+                        offset_id = message.id
+                        if _should_store(message):
+                            rows.append(history_row_from_message(message, self.account_id))
+                        if scanned % self.batch_size == 0:
+                            rows_inserted = await self._flush(chat.id, rows, offset_id, rows_inserted, False)
+                            rows = []
+                            elapsed = time.monotonic() - started
+                            logger.info(
+                                f"Chat {chat.id}: scanned {scanned}, inserted {rows_inserted} "
+                                f"({scanned / elapsed:.0f} msgs/s)"
+                            )
+                            await asyncio.sleep(BACKFILL_BATCH_DELAY)
+                        if self.limit and scanned >= self.limit:
+                            break
+                    break
+                except FloodWait as e:
+                    # Save what we have, wait out the flood limit and resume below offset_id
+                    rows_inserted = await self._flush(chat.id, rows, offset_id, rows_inserted, False)
+                    rows = []
+                    logger.warning(f"Chat {chat.id}: flood wait of {e.value}s, resuming afterwards")
+                    await asyncio.sleep(e.value)
+
+            reached_start = not (self.limit and scanned >= self.limit)
+            rows_inserted = await self._flush(chat.id, rows, offset_id, rows_inserted, reached_start)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            logger.info(
+                f"Chat {chat.id}: {'done' if reached_start else 'paused'} - scanned {scanned}, "
+                f"inserted {rows_inserted} total in {elapsed:.1f}s ({scanned / elapsed:.0f} msgs/s)"
+            )
+
+    async def run(self, chat_refs, restart: bool = False):
+        """Backfill several chats concurrently and report overall throughput."""
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(self.backfill_chat(chat_ref, restart=restart) for chat_ref in chat_refs),
+            return_exceptions=True,
+        )
+        for chat_ref, result in zip(chat_refs, results):
+            if isinstance(result, Exception):
+                logger.error(f"Backfill of chat {chat_ref} failed: {result}")
+        elapsed = max(time.monotonic() - started, 1e-6)
+        logger.info(
+            f"Backfill finished: {self.total_inserted} rows inserted in {elapsed:.1f}s "
+            f"({self.total_inserted / elapsed:.0f} rows/s)"
+        )
+        return self.total_inserted
+
+
+def _parse_chat_ref(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def chats_for_account(spec: str, account_id: str):
+    """
+    Chat refs in a BACKFILL_CHATS value that `account_id` should backfill.
+
+    Entries are comma-separated `account:chat`; a bare `chat` belongs to the
+    default account, so single-account setups keep working unchanged.
+    """
+    chat_refs = []
+    for entry in spec.split(","):
+        owner, separator, chat = entry.strip().rpartition(":")
+        if not separator:
+            owner = DEFAULT_ACCOUNT_ID
+        if chat.strip() and owner.strip() == account_id:
+            chat_refs.append(_parse_chat_ref(chat.strip()))
+    return chat_refs
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill Telegram history into ChatHistory")
+    parser.add_argument("chats", nargs="+", help="Chat ids or usernames to backfill")
+    parser.add_argument("--account", default=DEFAULT_ACCOUNT_ID, help="Hosted account to backfill with")
+    parser.add_argument("--limit", type=int, default=0, help="Max messages to scan per chat this run (0 = all)")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY, help="Chats paged at once")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints")
+    args = parser.parse_args()
+
+    session_string = load_accounts().get(args.account)
+    if not session_string:
+        logger.error(f"No session string configured for account '{args.account}'")
+        sys.exit(1)
+
+    import startup
+    startup.run_startup(background=False)
+
+    async with Client(f"envo_backfill_{args.account}", session_string=session_string, in_memory=True) as client:
+        backfiller = Backfiller(client, account_id=args.account, concurrency=args.concurrency, limit=args.limit)
+        await backfiller.run([_parse_chat_ref(chat) for chat in args.chats], restart=args.restart)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(main())
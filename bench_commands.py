@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for command dispatch and plugin startup cost.
+
+Compares the table-driven CommandRouter against the previous layout of one
+`filters.me & filters.command(...)` handler per command, and measures the
+import time that the lazily loaded plugins keep off the startup path.
+
+Usage:
+    python bench_commands.py [--updates N]
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+from types import SimpleNamespace
+from command_router import CommandRouter
+
+COMMANDS = [
+    "envo", "summarize", "translate", "rewrite", "improve", "expand", "condense",
+    "analyze", "explain", "help", "pass",
+]
+PLUGINS = ["vision", "voice", "search", "roleplay"]
+
+
+def _make_updates(count: int):
+    """A mix of outgoing commands and plain outgoing text, like a typical session."""
+    samples = [
+        ".envo what's the weather like",
+        ".summarize",
+        ".help",
+        "just a normal message I typed",
+        "another ordinary reply",
+        ".unknowncommand",
+        "ok",
+        ".translate hola amigo",
+    ]
+    me = SimpleNamespace(is_self=True)
+    return [
+        SimpleNamespace(text=samples[i % len(samples)], caption=None, from_user=me, outgoing=True, command=None)
+        for i in range(count)
+    ]
+
+
+def bench_router(updates):
+    router = CommandRouter(owner=None)
+    for command in COMMANDS:
+        router.register(command, lambda message: None)
+    started = time.perf_counter()
+    for message in updates:
+        router.resolve(message)
+    return (time.perf_counter() - started) / len(updates)
+
+
+def bench_filter_chain(updates):
+    """Evaluate the old per-command filter chains the way Pyrogram does: in order, until one matches."""
+    from pyrogram import filters
+
+    chains = [filters.me & filters.command(command, prefixes=".") for command in COMMANDS]
+    client = SimpleNamespace(me=SimpleNamespace(username="envo"))
+
+    async def run():
+        started = time.perf_counter()
+        for message in updates:
+            for chain in chains:
+                if await chain(client, message):
+                    break
+        return (time.perf_counter() - started) / len(updates)
+
+    return asyncio.run(run())
+
+
+# Modules the userbot has already imported by the time a plugin first loads; they're
+# imported before the timer starts so only the plugin's own cost is reported
+PRELOADED_MODULES = ["app", "models", "utils", "startup", "command_router"]
+
+
+def bench_plugin_imports():
+    """Import time of each plugin on top of the startup modules, i.e. the cost deferred from startup."""
+    results = {}
+    for plugin in PLUGINS:
+        code = (
+            f"import {', '.join(PRELOADED_MODULES)}; "
+            "import time; started = time.perf_counter(); "
+            f"import plugins.{plugin}; print(time.perf_counter() - started)"
+        )
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if proc.returncode == 0 and proc.stdout.strip():
+            results[plugin] = float(proc.stdout.strip().splitlines()[-1])
+        else:
+            results[plugin] = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark command dispatch and plugin startup cost")
+    parser.add_argument("--updates", type=int, default=100000)
+    args = parser.parse_args()
+
+    updates = _make_updates(args.updates)
+
+    router_cost = bench_router(updates)
+    print(f"CommandRouter dispatch:      {router_cost * 1e6:8.2f} us/update")
+    try:
+        chain_cost = bench_filter_chain(updates)
+        print(f"Per-command filter chains:   {chain_cost * 1e6:8.2f} us/update ({chain_cost / router_cost:.1f}x)")
+    except ImportError:
+        print("Per-command filter chains:   skipped (pyrogram not installed)")
+
+    total_deferred = 0.0
+    for plugin, seconds in bench_plugin_imports().items():
+        if seconds is None:
+            print(f"Plugin '{plugin}' import:    failed (missing dependency?)")
+            continue
+        total_deferred += seconds
+        print(f"Plugin '{plugin}' import:    {seconds * 1000:8.1f} ms deferred from startup")
+    print(f"Total deferred import time:  {total_deferred * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
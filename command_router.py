@@ -0,0 +1,80 @@
+import time
+import logging
+import importlib
+
+logger = logging.getLogger(__name__)
+
+COMMAND_PREFIX = "."
+
+# Load time of each lazily imported command plugin, in seconds
+PLUGIN_LOAD_TIMES = {}
+
+
+def load_plugin(name: str):
+    """Import `plugins.<name>` on first use and record how long the import took."""
+    module_name = f"plugins.{name}"
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if name not in PLUGIN_LOAD_TIMES:
+        PLUGIN_LOAD_TIMES[name] = time.perf_counter() - started
+        logger.info(f"Loaded plugin '{name}' in {PLUGIN_LOAD_TIMES[name] * 1000:.1f}ms")
+    return module
+
+
+class CommandRouter:
+    """
+    Single-dispatch table for userbot commands.
+
+    Instead of one Pyrogram filter chain per command, each outgoing message is
+    parsed once (prefix check + split) and looked up in a dict. Commands backed
+    by a plugin are registered by name and only imported the first time they run.
+    """
+
+    def __init__(self, owner, prefix: str = COMMAND_PREFIX):
+        self.owner = owner  # passed as the first argument to plugin handlers
+        self.prefix = prefix
+        self.routes = {}
+        self.lazy_routes = {}
+
+    def register(self, command: str, handler):
+        """Route `command` to an async handler taking the message."""
+        self.routes[command.lower()] = handler
+
+    def register_lazy(self, command: str, plugin: str, function: str):
+        """Route `command` to `plugins.<plugin>.<function>(owner, message)`, imported on first use."""
+        self.lazy_routes[command.lower()] = (plugin, function)
+
+    @property
+    def commands(self):
+        return sorted({*self.routes, *self.lazy_routes})
+
+    def parse(self, text: str):
+        """Return the lower-cased command name of `text`, or None if it isn't a command."""
+        if not text or not text.startswith(self.prefix):
+            return None
+        # Like filters.command, the name must follow the prefix directly (". envo" isn't a command)
+        if text[len(self.prefix):len(self.prefix) + 1].isspace():
+            return None
+        parts = text[len(self.prefix):].split(maxsplit=1)
+        return parts[0].lower() if parts else None
+
+    def resolve(self, message):
+        """Return (command, handler) for a message, or None when no route matches."""
+        command = self.parse(message.text or message.caption)
+        if command is None:
+            return None
+
+        handler = self.routes.get(command)
+        if handler is None:
+            lazy_route = self.lazy_routes.get(command)
+            if lazy_route is None:
+                return None
+            plugin, function = lazy_route
+            plugin_handler = getattr(load_plugin(plugin), function)
+
+            async def handler(message, _plugin_handler=plugin_handler):
+                await _plugin_handler(self.owner, message)
+
+            # Cache the resolved handler so later calls skip the import machinery
+            self.routes[command] = handler
+        return command, handler
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from models import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+# Rows pulled from the server-side cursor per round-trip. Memory use is bounded
+# by this number no matter how many rows the export contains.
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_COLUMNS = [column.name for column in ChatHistory.__table__.columns]
+
+
+def build_export_query(chat_id: int = None, since_id: int = None, account_id: str = None):
+    """Keyset-paginated select over ChatHistory, ordered by primary key."""
+    table = ChatHistory.__table__
+    stmt = select(*[table.c[name] for name in EXPORT_COLUMNS]).order_by(table.c.id)
+    if account_id is not None:
+        stmt = stmt.where(table.c.account_id == account_id)
+    if chat_id is not None:
+        stmt = stmt.where(table.c.chat_id == chat_id)
+    if since_id is not None:
+        stmt = stmt.where(table.c.id > since_id)
+    return stmt
+
+
+def _serialize_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _format_ndjson(rows):
+    return "".join(
+        json.dumps({name: _serialize_value(value) for name, value in zip(EXPORT_COLUMNS, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def _format_csv(rows, header: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([_serialize_value(value) for value in row])
+    return buffer.getvalue()
+
+
+def stream_chat_history(engine, fmt: str = "ndjson", chat_id: int = None, since_id: int = None, compress: bool = False,
+                        account_id: str = None):
+    """
+    Yield an export of ChatHistory as NDJSON or CSV chunks.
+
+    Rows are read through a server-side cursor (stream_results) in batches of
+    EXPORT_FETCH_SIZE, so only one batch is ever held in memory. Every row
+    carries its `id`; pass the last one seen as `since_id` to resume.
+    Rows moved to the cold archive (only when ARCHIVE_DIR is set) are not included.
+    """
+    formatter = _format_csv if fmt == "csv" else _format_ndjson
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 -> gzip container
+
+    def emit(text: str):
+        data = text.encode("utf-8")
+        if compressor:
+            # Sync-flush each batch so the client receives data as it is produced
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    if fmt == "csv":
+        yield emit(_format_csv([], header=True))
+
+    rows_exported = 0
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=EXPORT_FETCH_SIZE).execute(
+                build_export_query(chat_id=chat_id, since_id=since_id, account_id=account_id)
+            )
+            for batch in result.partitions():
+                rows_exported += len(batch)
+                yield emit(formatter(batch))
+    except Exception as e:
+        logger.error(f"Chat history export failed after {rows_exported} rows: {e}", exc_info=True)
+        raise
+
+    if compressor:
+        yield compressor.flush()
+    logger.info(f"Exported {rows_exported} chat history rows (chat_id={chat_id}, since_id={since_id}, format={fmt})")
@@ -1,26 +1,67 @@
 import os
+import json
 import logging
-from google import genai
-from google.genai import types
+from collections import OrderedDict
 from app import app, db  # <-- FIX: Imported the 'db' object
 from models import ChatHistory
+from accounts import DEFAULT_ACCOUNT_ID
+from startup import lazy_import
+from prompt_cache import GeminiPromptCache, LocalPromptCache
 
 logger = logging.getLogger(__name__)
 
+# Inline image bytes per vision request, kept well under the API's 20MB request cap
+VISION_REQUEST_MAX_BYTES = 15 * 1024 * 1024
+VISION_REQUEST_MAX_IMAGES = 10
+# Per-image descriptions kept in memory, keyed by Telegram's file_unique_id
+IMAGE_CACHE_SIZE = 256
+
+def _types():
+    """google.genai.types, imported on first use to keep it off the startup path."""
+    return lazy_import("google.genai.types")
+
+def _parse_image_descriptions(text: str, count: int):
+    """{image number: description} from the vision model's JSON answer; empty if it isn't usable."""
+    try:
+        items = json.loads(text or "")
+    except ValueError:
+        logger.error("Vision model returned invalid JSON for a batch of images")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    descriptions = {}
+    for position, item in enumerate(items, start=1):
+        if isinstance(item, dict):
+            number, description = item.get("image", position), item.get("description")
+        else:
+            number, description = position, item  # bare strings, in image order
+        if isinstance(number, int) and 1 <= number <= count and isinstance(description, str) and description.strip():
+            descriptions[number] = description.strip()
+    return descriptions
+
 class GeminiClient:
     def __init__(self):
+        # Per-image vision results, shared by every account using this client
+        self.image_cache = OrderedDict()
         api_key = os.environ.get("GEMINI_API_KEY")
         if not api_key:
             logger.warning("GEMINI_API_KEY is not set. GeminiClient will not function.")
             self.text_model = None
             self.vision_model = None
         else:
+            genai = lazy_import("google.genai")
             genai.configure(api_key=api_key)
             # <-- FIX: Initialize specific models for text and vision
             self.text_model = genai.GenerativeModel("gemini-1.5-flash")
             self.vision_model = genai.GenerativeModel("gemini-1.5-pro")
+        # Persona prefixes for roleplay sessions; falls back to resending them when caching isn't possible
+        if self.text_model:
+            self.prompt_cache = GeminiPromptCache(api_key, self.respond_with_system_prompt)
+        else:
+            self.prompt_cache = LocalPromptCache(self.respond_with_system_prompt)
 
-    async def generate_response(self, question: str, context: str = None, chat_id: int = None):
+    async def generate_response(self, question: str, context: str = None, chat_id: int = None, account_id: str = None):
         """Generate AI response with context and current information"""
         if not self.text_model:
             return "AI client is not configured. Missing GEMINI_API_KEY."
@@ -37,7 +78,7 @@ class GeminiClient:
             user_prompt_parts = []
             
             if chat_id:
-                chat_context = await self.get_recent_context(chat_id)
+                chat_context = await self.get_recent_context(chat_id, account_id=account_id)
                 if chat_context:
                     user_prompt_parts.append(f"Here's the recent chat history for context:\n---\n{chat_context}\n---")
 
@@ -51,7 +92,7 @@ class GeminiClient:
             # <-- FIX: Called generate_content on the model object, not the client
             response = await self.text_model.generate_content_async(
                 contents=[user_prompt],
-                generation_config=types.GenerationConfig(
+                generation_config=_types().GenerationConfig(
                     temperature=0.7,
                     max_output_tokens=2048
                 ),
@@ -64,6 +105,20 @@ class GeminiClient:
             logger.error(f"Gemini API error in generate_response: {e}", exc_info=True)
             return "Sorry, I'm having trouble connecting to my brain right now. Please try again in a moment."
 
+    async def respond_with_system_prompt(self, system_instruction: str, contents):
+        """Plain multi-turn request: `contents` are sent as-is under `system_instruction`."""
+        if not self.text_model:
+            return "AI client is not configured. Missing GEMINI_API_KEY."
+        response = await self.text_model.generate_content_async(
+            contents=contents,
+            generation_config=_types().GenerationConfig(
+                temperature=0.9,
+                max_output_tokens=1024
+            ),
+            system_instruction=system_instruction
+        )
+        return response.text.strip()
+
     async def process_content(self, content: str, command_type: str):
         """Process content based on a specific command (summarize, translate, etc.)."""
         if not self.text_model:
@@ -84,7 +139,7 @@ class GeminiClient:
             
             response = await self.text_model.generate_content_async(
                 contents=[prompt],
-                generation_config=types.GenerationConfig(
+                generation_config=_types().GenerationConfig(
                     temperature=0.5,
                     max_output_tokens=2048
                 ),
@@ -111,7 +166,7 @@ class GeminiClient:
 
             response = await self.text_model.generate_content_async(
                 contents=[prompt],
-                generation_config=types.GenerationConfig(
+                generation_config=_types().GenerationConfig(
                     temperature=0.6,
                     max_output_tokens=2048
                 ),
@@ -128,7 +183,7 @@ class GeminiClient:
             return "AI vision client is not configured."
         
         try:
-            image_part = types.Part.from_uri(
+            image_part = _types().Part.from_uri(
                 mime_type="image/jpeg",
                 uri=image_path
             )
@@ -141,13 +196,103 @@ class GeminiClient:
             logger.error(f"Image analysis error: {e}", exc_info=True)
             return "Failed to analyze the image."
 
-    async def get_recent_context(self, chat_id: int, limit: int = 7):
+    async def analyze_images(self, images):
+        """
+        Describe several images with as few model round-trips as possible.
+
+        `images` is a list of (cache_key, jpeg_bytes). Cached descriptions are
+        reused; the rest are sent together in one multimodal request per chunk
+        (bounded by VISION_REQUEST_MAX_BYTES / VISION_REQUEST_MAX_IMAGES), with
+        the model answering in JSON so each description maps back to its image.
+        Returns {cache_key: description}.
+        """
+        results = {}
+        pending = []
+        for key, data in images:
+            if key in self.image_cache:
+                self.image_cache.move_to_end(key)
+                results[key] = self.image_cache[key]
+            elif data is None:
+                # Caller expected a cache hit that has since been evicted
+                results[key] = "Could not analyze the image."
+            else:
+                pending.append((key, data))
+
+        if pending and not self.vision_model:
+            results.update({key: "AI vision client is not configured." for key, _ in pending})
+            return results
+
+        chunk, chunk_bytes = [], 0
+        for key, data in pending:
+            if chunk and (chunk_bytes + len(data) > VISION_REQUEST_MAX_BYTES or len(chunk) >= VISION_REQUEST_MAX_IMAGES):
+                results.update(await self._analyze_image_chunk(chunk))
+                chunk, chunk_bytes = [], 0
+            chunk.append((key, data))
+            chunk_bytes += len(data)
+        if chunk:
+            results.update(await self._analyze_image_chunk(chunk))
+        return results
+
+    async def _analyze_image_chunk(self, chunk):
+        """One vision request for a chunk of images; caches each parsed description."""
+        try:
+            contents = [
+                f"There are {len(chunk)} images below, numbered 1 to {len(chunk)}. Describe each one in detail "
+                "and extract any text. Answer with a JSON array holding one object per image: "
+                '{"image": <number>, "description": "<description>"}.'
+            ]
+            for number, (_, data) in enumerate(chunk, start=1):
+                contents.append(f"Image {number}:")
+                contents.append(_types().Part.from_bytes(data=data, mime_type="image/jpeg"))
+
+            response = await self.vision_model.generate_content_async(
+                contents,
+                generation_config=_types().GenerationConfig(response_mime_type="application/json"),
+            )
+            descriptions = _parse_image_descriptions(response.text, len(chunk))
+
+            results = {}
+            for number, (key, _) in enumerate(chunk, start=1):
+                description = descriptions.get(number)
+                if description:
+                    self._cache_image_result(key, description)
+                    results[key] = description
+                else:
+                    results[key] = "Could not analyze the image."
+            return results
+        except Exception as e:
+            logger.error(f"Batch image analysis error: {e}", exc_info=True)
+            return {key: "Failed to analyze the image." for key, _ in chunk}
+
+    def _cache_image_result(self, key, description: str):
+        self.image_cache[key] = description
+        self.image_cache.move_to_end(key)
+        while len(self.image_cache) > IMAGE_CACHE_SIZE:
+            self.image_cache.popitem(last=False)
+
+    async def get_recent_context(self, chat_id: int, limit: int = 7, account_id: str = None):
         """Get recent chat context for better conversational responses."""
         try:
             with app.app_context():
-                recent_messages = db.session.query(ChatHistory).filter_by(chat_id=chat_id).order_by(
+                account_id = account_id or DEFAULT_ACCOUNT_ID
+                # Account first so the read walks ix_chat_history_account_chat_timestamp
+                query = db.session.query(ChatHistory).filter(
+                    ChatHistory.account_id == account_id,
+                    ChatHistory.chat_id == chat_id,
+                    ChatHistory.is_deleted.is_(False),
+                    ChatHistory.message_text.isnot(None),
+                )
+                recent_messages = query.order_by(
                     ChatHistory.timestamp.desc()
                 ).limit(limit).all()
+
+                if len(recent_messages) < limit:
+                    # Hot table ran short; continue into the cold archive
+                    from archive import read_recent_archived
+                    recent_messages += read_recent_archived(
+                        chat_id, limit - len(recent_messages), account_id=account_id,
+                        before=recent_messages[-1].timestamp if recent_messages else None,
+                    )
                 
                 if not recent_messages:
                     return None
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import literal_column, or_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.postgresql import insert
+from app import app, db
+from models import ChatHistory
+from analytics import record_messages_bulk
+from accounts import DEFAULT_ACCOUNT_ID
+from archive import archived_chat_ids, drop_archived_rows, record_archived_deletions
+
+logger = logging.getLogger(__name__)
+
+# Live ingestion buffers rows and writes them as one upsert per batch
+WRITER_BATCH_SIZE = 200
+WRITER_FLUSH_INTERVAL = 0.5  # seconds
+# Rows held for retry while the database is unreachable; the oldest are dropped beyond this
+WRITER_MAX_PENDING = 10000
+
+# Media types whose payload carries a reusable Telegram file_id
+FILE_MEDIA_TYPES = {"audio", "document", "photo", "sticker", "video", "animation", "voice", "video_note"}
+
+# Columns refreshed when an already-stored message is seen again (edit or redelivery).
+# Identity, sender and the original timestamp are left alone.
+UPSERT_COLUMNS = [
+    "message_text", "message_type", "file_id", "reply_to_message_id", "media_group_id", "edited_at",
+]
+
+# Channels and supergroups use -100... ids; everything else shares one per-account message id sequence
+CHANNEL_ID_THRESHOLD = -1000000000000
+
+
+def message_type_of(message):
+    """Classify a Pyrogram message: text, a media type (photo, voice, ...), service or other."""
+    if message.text:
+        return 'text'
+    if message.media:
+        return message.media.value
+    if message.service:
+        return 'service'
+    return 'other'
+
+
+def _strip_nul(text):
+    # Postgres text can't hold NUL characters
+    return text.replace("\x00", "") if text else text
+
+
+def to_naive_utc(value: datetime):
+    """
+    Pyrogram builds dates with datetime.fromtimestamp(), i.e. naive local time;
+    the rest of the app stores and compares naive UTC.
+    """
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def history_row_from_message(message, account_id: str = DEFAULT_ACCOUNT_ID):
+    """Build a ChatHistory row dict from a Pyrogram message seen by `account_id`."""
+    user = message.from_user
+    message_type = message_type_of(message)
+    media = getattr(message, message_type, None) if message_type in FILE_MEDIA_TYPES else None
+    return {
+        "account_id": account_id,
+        "chat_id": message.chat.id,
+        "message_id": message.id,
+        "user_id": user.id if user else None,
+        "username": user.username if user else None,
+        "first_name": user.first_name if user else None,
+        "last_name": user.last_name if user else None,
+        "message_text": _strip_nul(message.text or message.caption),
+        "message_type": message_type,
+        "file_id": media.file_id if media else None,
+        "reply_to_message_id": message.reply_to_message_id,
+        "media_group_id": str(message.media_group_id) if message.media_group_id else None,
+        "edited_at": to_naive_utc(message.edit_date),
+        "timestamp": to_naive_utc(message.date) or datetime.utcnow(),
+    }
+
+
+def _bump_rollups(inserted):
+    record_messages_bulk(
+        (row.account_id, row.chat_id, row.user_id, row.first_name or row.username, row.timestamp)
+        for row in inserted
+    )
+
+
+def insert_history_rows(rows):
+    """
+    Multi-row insert into ChatHistory, skipping rows already stored.
+
+    Conflicts on (account_id, chat_id, message_id) are ignored, so re-running over the
+    same messages is harmless. Activity rollups are bumped only for the rows
+    that were actually new. Returns the number of rows inserted.
+    """
+    rows = drop_archived_rows(rows)
+    if not rows:
+        return 0
+    with app.app_context():
+        stmt = insert(ChatHistory).values(rows).on_conflict_do_nothing(
+            index_elements=['account_id', 'chat_id', 'message_id']
+        ).returning(
+            ChatHistory.account_id, ChatHistory.chat_id, ChatHistory.user_id, ChatHistory.first_name,
+            ChatHistory.username, ChatHistory.timestamp,
+        )
+        inserted = db.session.execute(stmt).all()
+        _bump_rollups(inserted)
+        db.session.commit()
+        return len(inserted)
+
+
+def upsert_history_rows(rows):
+    """
+    Batched INSERT ... ON CONFLICT DO UPDATE into ChatHistory.
+
+    Redeliveries collapse onto the stored row, and edits update its content
+    in place. An update only applies when it isn't older than the stored
+    edit, so a late redelivery of the original can't undo an edit. Rows
+    sharing a key within the batch are merged the same way, since one
+    statement can't update the same row twice. Rollups are bumped only for
+    rows that were newly inserted. Returns (inserted, updated).
+    """
+    if not rows:
+        return 0, 0
+    merged = {}
+    for row in rows:
+        key = (row["account_id"], row["chat_id"], row["message_id"])
+        previous = merged.get(key)
+        if previous is not None:
+            if previous["edited_at"] and (not row["edited_at"] or row["edited_at"] < previous["edited_at"]):
+                continue
+            # Keep the first-seen timestamp, take the newer content
+            row = {**row, "timestamp": previous["timestamp"]}
+        merged[key] = row
+    rows = drop_archived_rows(list(merged.values()))
+    if not rows:
+        return 0, 0
+
+    with app.app_context():
+        stmt = insert(ChatHistory).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['account_id', 'chat_id', 'message_id'],
+            set_={name: getattr(stmt.excluded, name) for name in UPSERT_COLUMNS},
+            where=or_(
+                ChatHistory.edited_at.is_(None),
+                stmt.excluded.edited_at >= ChatHistory.edited_at,
+            ),
+        ).returning(
+            ChatHistory.account_id, ChatHistory.chat_id, ChatHistory.user_id, ChatHistory.first_name,
+            ChatHistory.username, ChatHistory.timestamp,
+            # xmax is 0 only for tuples this statement inserted (Postgres-specific)
+            literal_column("(xmax = 0)").label("inserted"),
+        )
+        results = db.session.execute(stmt).all()
+        inserted = [row for row in results if row.inserted]
+        _bump_rollups(inserted)
+        db.session.commit()
+        return len(inserted), len(results) - len(inserted)
+
+
+def mark_deleted(account_id: str, message_ids, chat_id: int = None):
+    """
+    Flag stored messages as deleted instead of removing them.
+
+    Telegram omits the chat for deletions outside channels/supergroups; those
+    message ids are unique per account, so they're matched across its
+    non-channel chats. Messages already moved to the archive are tombstoned there.
+    """
+    if not message_ids:
+        return 0
+    with app.app_context():
+        query = ChatHistory.query.filter(
+            ChatHistory.account_id == account_id,
+            ChatHistory.message_id.in_(message_ids),
+        )
+        if chat_id is not None:
+            query = query.filter(ChatHistory.chat_id == chat_id)
+        else:
+            query = query.filter(ChatHistory.chat_id > CHANNEL_ID_THRESHOLD)
+        updated = query.update({ChatHistory.is_deleted: True}, synchronize_session=False)
+        db.session.commit()
+
+    if chat_id is not None:
+        chat_ids = [chat_id]
+    else:
+        chat_ids = [archived_chat for archived_chat in archived_chat_ids(account_id) if archived_chat > CHANNEL_ID_THRESHOLD]
+    return updated + record_archived_deletions(account_id, chat_ids, message_ids)
+
+
+class HistoryWriter:
+    """
+    Buffers live ChatHistory rows and flushes them as batched upserts.
+
+    A flush happens when WRITER_BATCH_SIZE rows are pending or every
+    WRITER_FLUSH_INTERVAL seconds, whichever comes first. Database work runs
+    in the default executor so the event loop keeps handling updates.
+    """
+
+    def __init__(self, batch_size: int = WRITER_BATCH_SIZE, flush_interval: float = WRITER_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write out whatever is still pending."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def add(self, row: dict):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            rows, self.pending = self.pending, []
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, upsert_history_rows, rows)
+            except OperationalError as e:
+                # Database unreachable: keep the rows for the next flush
+                self.pending = rows + self.pending
+                if len(self.pending) > WRITER_MAX_PENDING:
+                    dropped = len(self.pending) - WRITER_MAX_PENDING
+                    self.pending = self.pending[dropped:]
+                    logger.error(f"Dropped {dropped} buffered chat history rows while the database is unavailable")
+                logger.error(f"Error flushing {len(rows)} chat history rows, will retry: {e}")
+            except Exception as e:
+                # One bad row fails the whole statement; write the rest row by row
+                logger.warning(f"Batch upsert of {len(rows)} chat history rows failed, retrying row by row: {e}")
+                for row in rows:
+                    try:
+                        await loop.run_in_executor(None, upsert_history_rows, [row])
+                    except Exception as row_error:
+                        logger.error(f"Dropping chat history row {row['chat_id']}:{row['message_id']}: {row_error}")
+
+    async def delete(self, account_id: str, message_ids, chat_id: int = None):
+        # Flush first so a message stored moments ago is already there to flag
+        await self.flush()
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, mark_deleted, account_id, message_ids, chat_id)
+        except Exception as e:
+            logger.error(f"Error marking deleted messages: {e}")
@@ -1,4 +1,11 @@
+import startup
+
+# Time the imports below so the dashboard can show where boot time goes
+startup.install_import_timer()
+
 from app import app
 
+startup.run_startup()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,137 @@
+import re
+import logging
+from sqlalchemy import inspect, text
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+# Ordered, idempotent schema changes that db.create_all() can't apply to
+# tables that already exist. Each entry runs once, in its own transaction
+# (or statement by statement in autocommit, see CONCURRENT_MIGRATIONS), and
+# is recorded in the schema_migrations table.
+MIGRATIONS = [
+    ("0001_chat_history_unique_message", [
+        # Drop redeliveries/duplicates first, keeping the earliest copy
+        """
+        DELETE FROM chat_history a
+        USING chat_history b
+        WHERE a.chat_id = b.chat_id
+          AND a.message_id = b.message_id
+          AND a.id > b.id
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_history_chat_message ON chat_history (chat_id, message_id)",
+    ]),
+    ("0002_account_ownership", [
+        # Private-chat message ids are only unique per account, so ownership is part of the key
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS account_id VARCHAR(64) NOT NULL DEFAULT 'default'",
+        "DROP INDEX IF EXISTS uq_chat_history_chat_message",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_history_account_chat_message ON chat_history (account_id, chat_id, message_id)",
+        "ALTER TABLE backfill_checkpoint ADD COLUMN IF NOT EXISTS account_id VARCHAR(64) NOT NULL DEFAULT 'default'",
+        "ALTER TABLE backfill_checkpoint DROP CONSTRAINT IF EXISTS backfill_checkpoint_pkey",
+        "ALTER TABLE backfill_checkpoint ADD PRIMARY KEY (account_id, chat_id)",
+    ]),
+    ("0003_media_metadata_and_edits", [
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS media_group_id VARCHAR(64)",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS edited_at TIMESTAMP",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS is_deleted BOOLEAN NOT NULL DEFAULT false",
+    ]),
+    ("0004_hot_path_indexes", [
+        # Recent-context and search reads: equality on the chat, ordered by timestamp, LIMIT N
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_history_account_chat_timestamp ON chat_history (account_id, chat_id, timestamp)",
+        # Per-user rate-limit count over the last minute; both columns in the key, so index-only
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_command_queue_user_created ON command_queue (user_id, created_at)",
+        # Per-chat analytics window. Counters stay out of the index so rollup upserts remain HOT updates.
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_activity_chat_bucket ON chat_activity_rollup (chat_id, bucket_start)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_command_usage_chat_bucket ON command_usage_rollup (chat_id, bucket_start)",
+    ]),
+    ("0005_rollup_account_ownership", [
+        # Accounts sharing a group each see its messages; count them per account instead of twice in one row
+        "ALTER TABLE chat_activity_rollup ADD COLUMN IF NOT EXISTS account_id VARCHAR(64) NOT NULL DEFAULT 'default'",
+        "ALTER TABLE chat_activity_rollup DROP CONSTRAINT IF EXISTS uq_chat_activity_bucket",
+        "ALTER TABLE chat_activity_rollup ADD CONSTRAINT uq_chat_activity_bucket UNIQUE (account_id, chat_id, user_id, granularity, bucket_start)",
+        "ALTER TABLE command_usage_rollup ADD COLUMN IF NOT EXISTS account_id VARCHAR(64) NOT NULL DEFAULT 'default'",
+        "ALTER TABLE command_usage_rollup DROP CONSTRAINT IF EXISTS uq_command_usage_bucket",
+        "ALTER TABLE command_usage_rollup ADD CONSTRAINT uq_command_usage_bucket UNIQUE (account_id, command, chat_id, granularity, bucket_start)",
+    ]),
+    ("0006_drop_media_group_index", [
+        # Nothing queries media_group_id (albums come from get_media_group); the index only slowed ingestion
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_chat_history_media_group_id",
+    ]),
+    ("0007_drop_chat_history_chat_index", [
+        # Every chat_history read now filters on account_id first, which the composite indexes lead with
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_chat_history_chat_id",
+    ]),
+]
+
+# Index changes on large, live tables: CREATE/DROP INDEX CONCURRENTLY doesn't
+# block writes but can't run inside a transaction, so these run in autocommit.
+CONCURRENT_MIGRATIONS = {"0004_hot_path_indexes", "0006_drop_media_group_index", "0007_drop_chat_history_chat_index"}
+
+_CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+def _drop_invalid_index(conn, name: str):
+    """Drop an index left INVALID by an interrupted concurrent build, so IF NOT EXISTS doesn't keep it."""
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        logger.warning(f"Dropping invalid index {name} left by an interrupted build")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def _apply_concurrently(statements):
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in statements:
+            match = _CONCURRENT_INDEX_RE.search(statement)
+            if match:
+                _drop_invalid_index(conn, match.group(1))
+            conn.execute(text(statement))
+
+
+def run_migrations():
+    """
+    Create missing tables and apply any pending migrations. Safe to call on every start.
+
+    On an up-to-date database this costs two cheap catalog queries; the
+    heavier db.create_all() only runs when a model table is actually missing.
+    """
+    with app.app_context():
+        # Import models here to ensure they are registered with SQLAlchemy
+        import models
+
+        existing_tables = set(inspect(db.engine).get_table_names())
+        missing_tables = set(db.metadata.tables) - existing_tables
+        if missing_tables:
+            logger.info(f"Creating missing tables: {', '.join(sorted(missing_tables))}")
+            db.create_all()
+
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "id VARCHAR(128) PRIMARY KEY, "
+                "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+            ))
+            applied = {row[0] for row in conn.execute(text("SELECT id FROM schema_migrations"))}
+
+        for migration_id, statements in MIGRATIONS:
+            if migration_id in applied:
+                continue
+            logger.info(f"Applying migration {migration_id}...")
+            if migration_id in CONCURRENT_MIGRATIONS:
+                # Each statement is idempotent, so an interrupted run just repeats on the next start
+                _apply_concurrently(statements)
+                with db.engine.begin() as conn:
+                    conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": migration_id})
+                logger.info(f"Migration {migration_id} applied.")
+                continue
+            with db.engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+                conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": migration_id})
+            logger.info(f"Migration {migration_id} applied.")
+
+
+if __name__ == '__main__':
+    run_migrations()
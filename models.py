@@ -4,21 +4,30 @@ from sqlalchemy import Text, BigInteger
 
 class ChatHistory(db.Model):
     """Store complete chat history for context retrieval"""
+    __table_args__ = (
+        db.Index('uq_chat_history_account_chat_message', 'account_id', 'chat_id', 'message_id', unique=True),
+        # Context and search reads: one chat's messages, newest first
+        db.Index('ix_chat_history_account_chat_timestamp', 'account_id', 'chat_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(BigInteger, nullable=False, index=True)
+    account_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')  # owning hosted account
+    chat_id = db.Column(BigInteger, nullable=False)
     message_id = db.Column(BigInteger, nullable=False)
     user_id = db.Column(BigInteger, nullable=True)
     username = db.Column(db.String(64), nullable=True)
     first_name = db.Column(db.String(64), nullable=True)
     last_name = db.Column(db.String(64), nullable=True)
     message_text = db.Column(Text, nullable=True)
-    message_type = db.Column(db.String(32), nullable=False, default='text')  # text, photo, voice, video, document
+    message_type = db.Column(db.String(32), nullable=False, default='text')  # text, photo, voice, video, document, ..., service, other
     file_id = db.Column(db.String(256), nullable=True)
     reply_to_message_id = db.Column(BigInteger, nullable=True)
+    media_group_id = db.Column(db.String(64), nullable=True)  # album the message belongs to
+    edited_at = db.Column(db.DateTime, nullable=True)
+    is_deleted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     def __repr__(self):
-        return f'<ChatHistory {self.chat_id}:{self.message_id}>'
+        return f'<ChatHistory {self.account_id}/{self.chat_id}:{self.message_id}>'
 
 class UserContext(db.Model):
     """Store user-specific context and preferences"""
@@ -33,6 +42,10 @@ class UserContext(db.Model):
 
 class CommandQueue(db.Model):
     """Queue system for rate limiting"""
+    __table_args__ = (
+        # Covers the per-user rate-limit count (index-only scan)
+        db.Index('ix_command_queue_user_created', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     chat_id = db.Column(BigInteger, nullable=False)
     user_id = db.Column(BigInteger, nullable=False)
@@ -43,3 +56,50 @@ class CommandQueue(db.Model):
     
     def __repr__(self):
         return f'<CommandQueue {self.command} - {self.status}>'
+
+class ChatActivityRollup(db.Model):
+    """Pre-aggregated message counts per chat, sender and time bucket"""
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'chat_id', 'user_id', 'granularity', 'bucket_start', name='uq_chat_activity_bucket'),
+        db.Index('ix_chat_activity_chat_bucket', 'chat_id', 'bucket_start'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')  # hosted account that saw the messages
+    chat_id = db.Column(BigInteger, nullable=False)
+    user_id = db.Column(BigInteger, nullable=False, default=0)  # 0 = anonymous / channel post
+    display_name = db.Column(db.String(64), nullable=True)
+    granularity = db.Column(db.String(8), nullable=False, default='hour')  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChatActivityRollup {self.account_id}/{self.chat_id}:{self.user_id} {self.granularity}@{self.bucket_start}>'
+
+class CommandUsageRollup(db.Model):
+    """Pre-aggregated command usage counters per chat and time bucket"""
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'command', 'chat_id', 'granularity', 'bucket_start', name='uq_command_usage_bucket'),
+        db.Index('ix_command_usage_chat_bucket', 'chat_id', 'bucket_start'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.String(64), nullable=False, default='default', server_default='default')  # hosted account that ran the command
+    command = db.Column(db.String(64), nullable=False)
+    chat_id = db.Column(BigInteger, nullable=False)
+    granularity = db.Column(db.String(8), nullable=False, default='hour')  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    use_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CommandUsageRollup {self.account_id}/{self.command} {self.granularity}@{self.bucket_start}>'
+
+class BackfillCheckpoint(db.Model):
+    """Per-chat progress of the history backfill, so an interrupted run can resume"""
+    account_id = db.Column(db.String(64), primary_key=True, default='default', server_default='default')
+    chat_id = db.Column(BigInteger, primary_key=True, autoincrement=False)
+    oldest_message_id = db.Column(BigInteger, nullable=True)  # resume point: next page starts below this id
+    rows_inserted = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BackfillCheckpoint {self.account_id}/{self.chat_id} @{self.oldest_message_id}>'
@@ -0,0 +1,7 @@
+"""
+Lazily loaded userbot command plugins.
+
+Modules here are imported by command_router.load_plugin() the first time a
+command (or .envo media handling) needs them, keeping their heavy
+dependencies off the startup path.
+"""
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from utils import format_error_message
+
+logger = logging.getLogger(__name__)
+
+async def process_roleplay_command(manager, message):
+    """Handle `.roleplay [character]`: start answering `.envo` in character."""
+    try:
+        command_parts = (message.text or "").split(maxsplit=1)
+        character = command_parts[1].strip() if len(command_parts) > 1 else ""
+        if not character:
+            session = await manager.roleplay.get(message.from_user.id)
+            if session:
+                await message.edit_text(f"🎭 Currently roleplaying as **{session.character}**. Use `.clear` to stop.")
+            else:
+                await message.edit_text("Please provide a character to `roleplay` as.")
+                await asyncio.sleep(3)
+                await message.delete()
+            return
+
+        await manager.roleplay.start(message.from_user.id, character)
+        await message.edit_text(f"🎭 Roleplaying as **{character}**. `.envo` now answers in character; `.clear` to stop.")
+    except Exception as e:
+        error_msg = format_error_message("ROLEPLAY_ERROR", str(e))
+        await manager.client.send_message(message.chat.id, error_msg)
+        await message.delete()
+        logger.error(f"Error in roleplay command: {e}", exc_info=True)
+
+async def process_clear_command(manager, message):
+    """Handle `.clear`: end the roleplay and drop its conversation."""
+    try:
+        await manager.roleplay.clear(message.from_user.id)
+        await message.edit_text("🧹 Roleplay and conversation context cleared.")
+        await asyncio.sleep(3)
+        await message.delete()
+    except Exception as e:
+        error_msg = format_error_message("CLEAR_ERROR", str(e))
+        await manager.client.send_message(message.chat.id, error_msg)
+        await message.delete()
+        logger.error(f"Error in clear command: {e}", exc_info=True)
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from app import app, db
+from models import ChatHistory
+from utils import format_error_message
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULT_LIMIT = 10
+
+def _escape_like(term: str):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_chat_history(account_id: str, chat_id: int, term: str, limit: int = SEARCH_RESULT_LIMIT):
+    """Most recent messages in a chat containing `term` (case-insensitive), then archived ones."""
+    with app.app_context():
+        results = db.session.query(ChatHistory).filter(
+            ChatHistory.account_id == account_id,
+            ChatHistory.chat_id == chat_id,
+            ChatHistory.is_deleted.is_(False),
+            ChatHistory.message_text.ilike(f"%{_escape_like(term)}%", escape="\\"),
+        ).order_by(ChatHistory.timestamp.desc()).limit(limit).all()
+
+    if len(results) < limit:
+        from archive import search_archive
+        results += search_archive(chat_id, term, limit - len(results), account_id=account_id)
+    return results
+
+async def process_search_command(manager, message):
+    """Handle `.search [query]` by searching this chat's stored history."""
+    try:
+        command_parts = (message.text or "").split(maxsplit=1)
+        term = command_parts[1].strip() if len(command_parts) > 1 else ""
+        if not term:
+            await message.edit_text("Please provide something to `search` for.")
+            await asyncio.sleep(3)
+            await message.delete()
+            return
+
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(
+            None, search_chat_history, manager.account_id, message.chat.id, term
+        )
+        if not results:
+            await message.edit_text(f"🔍 No messages found for `{term}`.")
+            return
+
+        lines = [f"🔍 **Results for** `{term}`:\n"]
+        for msg in results:
+            user_info = msg.first_name or msg.username or f"User_{msg.user_id}"
+            snippet = msg.message_text if len(msg.message_text) <= 200 else msg.message_text[:200] + "…"
+            lines.append(f"• [{msg.timestamp.strftime('%Y-%m-%d %H:%M')}] **{user_info}:** {snippet}")
+        await message.edit_text("\n".join(lines), disable_web_page_preview=True)
+    except Exception as e:
+        error_msg = format_error_message("SEARCH_ERROR", str(e))
+        await manager.client.send_message(message.chat.id, error_msg)
+        await message.delete()
+        logger.error(f"Error in search command: {e}", exc_info=True)
@@ -0,0 +1,79 @@
+import io
+import asyncio
+import logging
+from startup import lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Longest side of images sent to the vision model; keeps album requests small
+VISION_MAX_DIMENSION = 1024
+VISION_JPEG_QUALITY = 85
+
+def _downscale(data: bytes):
+    """Shrink an image to VISION_MAX_DIMENSION and re-encode it as JPEG."""
+    Image = lazy_import("PIL.Image")
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((VISION_MAX_DIMENSION, VISION_MAX_DIMENSION))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=VISION_JPEG_QUALITY)
+        return output.getvalue()
+
+async def _load_photo(manager, message):
+    """Download one photo into memory and downscale it off the event loop."""
+    buffer = await manager.client.download_media(message, in_memory=True)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, _downscale, bytes(buffer.getbuffer()))
+
+async def describe_photo(manager, message):
+    """Analyze the photo in `message` (or its whole album) for use as .envo context."""
+    try:
+        if message.media_group_id:
+            return await describe_album(manager, message)
+
+        cache_key = message.photo.file_unique_id
+        if cache_key in manager.gemini.image_cache:
+            images = [(cache_key, None)]
+        else:
+            images = [(cache_key, await _load_photo(manager, message))]
+        descriptions = await manager.gemini.analyze_images(images)
+        return f"Image content: {descriptions[cache_key]}"
+    except Exception as e:
+        logger.error(f"Image analysis error: {e}")
+        return "Image: Could not analyze"
+
+async def describe_album(manager, message):
+    """
+    Analyze every photo of the media group `message` belongs to.
+
+    Items are downloaded concurrently and sent in as few vision requests as
+    possible; photos already described are served from the shared cache
+    without being downloaded again.
+    """
+    album = await manager.client.get_media_group(message.chat.id, message.id)
+    photos = [item for item in album if item.photo]
+    if not photos:
+        return "Album: no photos to analyze"
+
+    cached = manager.gemini.image_cache
+    to_download = [item for item in photos if item.photo.file_unique_id not in cached]
+    downloaded = await asyncio.gather(*(_load_photo(manager, item) for item in to_download), return_exceptions=True)
+
+    images = [(item.photo.file_unique_id, None) for item in photos if item.photo.file_unique_id in cached]
+    for item, data in zip(to_download, downloaded):
+        if isinstance(data, Exception):
+            logger.error(f"Album item {item.id} download failed: {data}")
+            continue
+        images.append((item.photo.file_unique_id, data))
+
+    descriptions = await manager.gemini.analyze_images(images)
+
+    lines = [f"Album of {len(photos)} photos:"]
+    for number, item in enumerate(photos, start=1):
+        marker = " (the one replied to)" if item.id == message.id else ""
+        description = descriptions.get(item.photo.file_unique_id, "Could not download this photo.")
+        lines.append(f"Image {number}{marker}: {description}")
+    skipped = len(album) - len(photos)
+    if skipped:
+        lines.append(f"({skipped} non-photo item(s) in the album were not analyzed)")
+    return "\n".join(lines)
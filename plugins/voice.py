@@ -0,0 +1,55 @@
+import os
+import asyncio
+import logging
+import speech_recognition as sr
+
+logger = logging.getLogger(__name__)
+
+async def transcribe_voice(voice_path: str):
+    """Transcribe voice message to text"""
+    try:
+        # Run transcription in thread pool to avoid blocking
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, _transcribe_sync, voice_path)
+    except Exception as e:
+        logger.error(f"Voice transcription error: {e}")
+        return "Could not transcribe voice message"
+
+def _transcribe_sync(voice_path: str):
+    """Synchronous voice transcription"""
+    try:
+        recognizer = sr.Recognizer()
+        
+        # Convert to WAV if needed (speech_recognition works better with WAV)
+        with sr.AudioFile(voice_path) as source:
+            audio = recognizer.record(source)
+            
+        # Try Google Speech Recognition
+        try:
+            text = recognizer.recognize_google(audio)
+            return text
+        except sr.UnknownValueError:
+            return "Could not understand audio"
+        except sr.RequestError:
+            # Fallback to other recognition methods
+            try:
+                text = recognizer.recognize_sphinx(audio)
+                return text
+            except:
+                return "Speech recognition service unavailable"
+                
+    except Exception as e:
+        logger.error(f"Sync transcription error: {e}")
+        return "Error transcribing audio"
+
+async def describe_voice(manager, message):
+    """Download and transcribe the voice note in `message` for use as .envo context."""
+    try:
+        voice_path = await manager.client.download_media(message.voice)
+        try:
+            return f"Voice message transcription: {await transcribe_voice(voice_path)}"
+        finally:
+            os.remove(voice_path)
+    except Exception as e:
+        logger.error(f"Voice transcription error: {e}")
+        return "Voice: Could not transcribe"
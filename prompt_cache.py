@@ -0,0 +1,155 @@
+import os
+import abc
+import uuid
+import logging
+from startup import lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Model used for cached roleplay turns; context caching needs a model that supports it
+PROMPT_CACHE_MODEL = os.environ.get("PROMPT_CACHE_MODEL", "gemini-2.5-flash")
+# Smallest prefix Gemini will cache for that model (1024 tokens for 2.5 Flash); shorter ones are resent locally
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", 1024))
+CHARS_PER_TOKEN = 4  # rough estimate, good enough to skip requests that would be rejected
+
+
+def to_contents(turns):
+    """Session turns ({"role", "text"}) in the model's contents format."""
+    return [{"role": turn["role"], "parts": [{"text": turn["text"]}]} for turn in turns]
+
+
+class PromptHandle:
+    """A prompt prefix (system instruction + earlier turns) registered with a PromptCache."""
+
+    def __init__(self, name: str, system_instruction: str, turns, upstream: str = None):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.turns = list(turns)
+        self.upstream = upstream  # server-side cache name when the prefix is cached upstream
+
+    def __repr__(self):
+        where = "upstream" if self.upstream is not None else "local"
+        return f'<PromptHandle {self.name} ({where}, {len(self.turns)} turns)>'
+
+
+class PromptCache(abc.ABC):
+    """
+    Keeps a reusable prompt prefix so each request only carries what's new.
+
+    `open()` registers a system instruction plus the turns so far and returns
+    a handle; `generate()` sends just the delta turns against that handle;
+    `release()` drops it once the session no longer needs it.
+    """
+
+    @abc.abstractmethod
+    async def open(self, system_instruction: str, turns, ttl_seconds: int) -> PromptHandle:
+        """Register a prefix and return its handle."""
+
+    @abc.abstractmethod
+    async def generate(self, handle: PromptHandle, delta_turns) -> str:
+        """Reply to `delta_turns`, continuing from the handle's prefix."""
+
+    @abc.abstractmethod
+    async def release(self, handle: PromptHandle):
+        """Forget a prefix that is no longer needed."""
+
+
+class LocalPromptCache(PromptCache):
+    """
+    Prefix kept in process memory and prepended to every request.
+
+    `responder(system_instruction, contents)` produces the reply, so this
+    doubles as an offline fake (pass a stub responder) and as the fallback
+    for prefixes too small for upstream caching.
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.handles = {}
+
+    async def open(self, system_instruction: str, turns, ttl_seconds: int) -> PromptHandle:
+        handle = PromptHandle(uuid.uuid4().hex, system_instruction, turns)
+        self.handles[handle.name] = handle
+        return handle
+
+    async def generate(self, handle: PromptHandle, delta_turns) -> str:
+        return await self.responder(handle.system_instruction, to_contents(handle.turns + list(delta_turns)))
+
+    async def release(self, handle: PromptHandle):
+        self.handles.pop(handle.name, None)
+
+
+class GeminiPromptCache(LocalPromptCache):
+    """
+    Gemini context caching through the google-genai client: the prefix is
+    stored server-side (client.caches) and each turn references it with
+    `cached_content`, so only delta turns are uploaded. Prefixes under
+    PROMPT_CACHE_MIN_TOKENS, and any upstream failure, fall back to the
+    local behaviour of resending the prefix.
+    """
+
+    def __init__(self, api_key: str, responder, model: str = PROMPT_CACHE_MODEL,
+                 temperature: float = 0.9, max_output_tokens: int = 1024):
+        super().__init__(responder)
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+        self.max_output_tokens = max_output_tokens
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = lazy_import("google.genai").Client(api_key=self.api_key)
+        return self._client
+
+    async def open(self, system_instruction: str, turns, ttl_seconds: int) -> PromptHandle:
+        prefix_chars = len(system_instruction) + sum(len(turn["text"]) for turn in turns)
+        if prefix_chars // CHARS_PER_TOKEN < PROMPT_CACHE_MIN_TOKENS:
+            return await super().open(system_instruction, turns, ttl_seconds)
+        try:
+            types = lazy_import("google.genai.types")
+            cached = await self.client.aio.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    contents=to_contents(turns) or None,
+                    ttl=f"{ttl_seconds}s",
+                ),
+            )
+            logger.info(f"Cached {prefix_chars} prompt prefix chars upstream as {cached.name}")
+            return PromptHandle(cached.name, system_instruction, turns, upstream=cached.name)
+        except Exception as e:
+            logger.error(f"Prompt cache creation failed, resending prefix instead: {e}")
+            return await super().open(system_instruction, turns, ttl_seconds)
+
+    async def generate(self, handle: PromptHandle, delta_turns) -> str:
+        if handle.upstream is None:
+            return await super().generate(handle, delta_turns)
+        try:
+            types = lazy_import("google.genai.types")
+            response = await self.client.aio.models.generate_content(
+                model=self.model,
+                contents=to_contents(delta_turns),
+                config=types.GenerateContentConfig(
+                    cached_content=handle.upstream,
+                    temperature=self.temperature,
+                    max_output_tokens=self.max_output_tokens,
+                ),
+            )
+            return (response.text or "").strip()
+        except Exception as e:
+            # Expired or evicted upstream; answer from the local copy of the prefix
+            logger.error(f"Cached prompt {handle.name} unusable, resending prefix: {e}")
+            handle.upstream = None
+            return await super().generate(handle, delta_turns)
+
+    async def release(self, handle: PromptHandle):
+        await super().release(handle)
+        if handle.upstream is None:
+            return
+        name, handle.upstream = handle.upstream, None
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            logger.error(f"Failed to delete cached prompt {name}: {e}")
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the hot read paths.
+
+Loads a synthetic multi-million-row dataset into a scratch Postgres database,
+runs each hot query through the real application code, and EXPLAINs the SQL
+it issued. A check fails when a plan has a Seq Scan, sorts rows an index
+should have delivered in order, or doesn't use the index expected for that
+path. Latency of each path is recorded alongside.
+
+Needs a database of its own, never the live one:
+
+    QUERY_PLAN_DATABASE_URL=postgresql://localhost/envo_plan_check \\
+        python query_plan_check.py [--rows N] [--reuse] [--output results.json]
+
+Exits non-zero if any check fails.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+PLAN_DATABASE_URL = os.environ.get("QUERY_PLAN_DATABASE_URL")
+if not PLAN_DATABASE_URL:
+    sys.exit("Set QUERY_PLAN_DATABASE_URL to a scratch Postgres database")
+if PLAN_DATABASE_URL == os.environ.get("DATABASE_URL"):
+    sys.exit("QUERY_PLAN_DATABASE_URL must not be the application database")
+
+# Point the app (and its archive fallback) at scratch locations before it is imported
+os.environ["DATABASE_URL"] = PLAN_DATABASE_URL
+os.environ["ARCHIVE_DIR"] = tempfile.mkdtemp(prefix="envo-plan-archive-")
+
+from sqlalchemy import event, text
+from app import app, db
+from migrations import run_migrations
+
+BUSY_CHAT = -1001000000000
+ACCOUNT_ID = "default"
+RATE_LIMITED_USER = 1000
+
+# Bitmap scans are fine for range windows; ordered paths still fail on the Sort they need
+SCAN_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+SORT_NODES = ("Sort", "Incremental Sort")
+
+# --- Synthetic data ---
+
+# Half of all messages land in one busy chat, the rest spread over 200 chats;
+# 10% belong to a second account. Timestamps step back one second per row.
+LOAD_CHAT_HISTORY = """
+INSERT INTO chat_history (account_id, chat_id, message_id, user_id, username, first_name,
+                          message_text, message_type, is_deleted, timestamp)
+SELECT CASE WHEN g % 10 = 0 THEN 'second' ELSE :account_id END,
+       CASE WHEN g % 2 = 0 THEN :busy_chat ELSE :busy_chat - 1 - (g % 200) END,
+       g,
+       1000 + g % 5000,
+       'user' || (g % 5000),
+       'User ' || (g % 5000),
+       'synthetic message ' || g || ' about ' || (ARRAY['cats', 'weather', 'football', 'music', 'work'])[1 + g % 5],
+       'text',
+       g % 97 = 0,
+       (now() AT TIME ZONE 'utc') - g * interval '1 second'
+FROM generate_series(:start, :stop) AS g
+"""
+
+LOAD_COMMAND_QUEUE = """
+INSERT INTO command_queue (chat_id, user_id, command, status, created_at, processed_at)
+SELECT :busy_chat - (g % 100), 1000 + g % 2000, 'envo', 'completed',
+       (now() AT TIME ZONE 'utc') - g * interval '1 second',
+       (now() AT TIME ZONE 'utc') - g * interval '1 second'
+FROM generate_series(1, :rows) AS g
+"""
+
+# Shaped like a compacted table: hourly buckets for the last 7 days (100 chats x 5 senders
+# each), daily buckets (100 chats x 20 senders) for every day before that
+HOURLY_BUCKETS = 7 * 24
+
+LOAD_ACTIVITY_ROLLUP = """
+INSERT INTO chat_activity_rollup (chat_id, user_id, display_name, granularity, bucket_start, message_count)
+SELECT :busy_chat - (g % 100), 1000 + (g / 100) % 5, 'User ' || ((g / 100) % 5), 'hour',
+       date_trunc('hour', now() AT TIME ZONE 'utc') - (g / 500) * interval '1 hour',
+       1 + g % 7
+FROM generate_series(0, :hourly_buckets * 500 - 1) AS g
+UNION ALL
+SELECT :busy_chat - (g % 100), 1000 + (g / 100) % 20, 'User ' || ((g / 100) % 20), 'day',
+       date_trunc('day', now() AT TIME ZONE 'utc') - (8 + g / 2000) * interval '1 day',
+       1 + g % 50
+FROM generate_series(0, :rows - 1) AS g
+"""
+
+# Hourly: 10 commands x 20 chats; daily: 10 commands x 100 chats
+LOAD_COMMAND_ROLLUP = """
+INSERT INTO command_usage_rollup (command, chat_id, granularity, bucket_start, use_count)
+SELECT (ARRAY['envo', 'summarize', 'translate', 'rewrite', 'improve',
+              'expand', 'condense', 'analyze', 'explain', 'search'])[1 + g % 10],
+       :busy_chat - (g / 10) % 20, 'hour',
+       date_trunc('hour', now() AT TIME ZONE 'utc') - (g / 200) * interval '1 hour',
+       1 + g % 3
+FROM generate_series(0, :hourly_buckets * 200 - 1) AS g
+UNION ALL
+SELECT (ARRAY['envo', 'summarize', 'translate', 'rewrite', 'improve',
+              'expand', 'condense', 'analyze', 'explain', 'search'])[1 + g % 10],
+       :busy_chat - (g / 10) % 100, 'day',
+       date_trunc('day', now() AT TIME ZONE 'utc') - (8 + g / 1000) * interval '1 day',
+       1 + g % 40
+FROM generate_series(0, :rows - 1) AS g
+"""
+
+LOAD_BATCH = 500000
+
+
+def load_dataset(rows: int):
+    """Bulk-load synthetic rows with generate_series, then VACUUM ANALYZE so plans and visibility maps are realistic."""
+    with db.engine.begin() as conn:
+        for start in range(1, rows + 1, LOAD_BATCH):
+            stop = min(start + LOAD_BATCH - 1, rows)
+            conn.execute(text(LOAD_CHAT_HISTORY), {
+                "account_id": ACCOUNT_ID, "busy_chat": BUSY_CHAT, "start": start, "stop": stop,
+            })
+            print(f"  chat_history: {stop:,}/{rows:,} rows")
+        conn.execute(text(LOAD_COMMAND_QUEUE), {"busy_chat": BUSY_CHAT, "rows": rows // 2})
+        conn.execute(text(LOAD_ACTIVITY_ROLLUP), {"busy_chat": BUSY_CHAT, "rows": rows // 2, "hourly_buckets": HOURLY_BUCKETS})
+        conn.execute(text(LOAD_COMMAND_ROLLUP), {"busy_chat": BUSY_CHAT, "rows": rows // 10, "hourly_buckets": HOURLY_BUCKETS})
+
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in ("chat_history", "command_queue", "chat_activity_rollup", "command_usage_rollup"):
+            conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+def table_sizes():
+    tables = ("chat_history", "command_queue", "chat_activity_rollup", "command_usage_rollup")
+    with db.engine.connect() as conn:
+        return {table: conn.execute(text(f"SELECT count(*) FROM {table}")).scalar() for table in tables}
+
+
+# --- Hot queries, issued through the application code ---
+
+def _recent_context():
+    from gemini_client import GeminiClient
+    return asyncio.run(GeminiClient().get_recent_context(BUSY_CHAT, account_id=ACCOUNT_ID))
+
+
+def _chat_context():
+    from utils import get_chat_context
+    return asyncio.run(get_chat_context(BUSY_CHAT, account_id=ACCOUNT_ID))
+
+
+def _search():
+    from plugins.search import search_chat_history
+    return search_chat_history(ACCOUNT_ID, BUSY_CHAT, "football")
+
+
+def _rate_limit():
+    from utils import check_rate_limit
+    return asyncio.run(check_rate_limit(RATE_LIMITED_USER, BUSY_CHAT))
+
+
+def _activity_summary():
+    from analytics import get_activity_summary
+    return get_activity_summary(chat_id=BUSY_CHAT)
+
+
+def _dashboard_summary():
+    # What the dashboard requests: /api/analytics?days=7, no chat filter
+    from analytics import get_activity_summary
+    return get_activity_summary(days=7)
+
+
+# (name, callable, indexes each statement may use, Index Only Scan required, index must supply the order).
+# The analytics queries sort their aggregated groups, which is cheap, so sorts are only policed on the ORDER BY ... LIMIT paths.
+HOT_QUERIES = [
+    ("recent_context", _recent_context, {"ix_chat_history_account_chat_timestamp"}, False, True),
+    ("chat_context", _chat_context, {"ix_chat_history_account_chat_timestamp"}, False, True),
+    ("search", _search, {"ix_chat_history_account_chat_timestamp"}, False, True),
+    ("rate_limit", _rate_limit, {"ix_command_queue_user_created"}, True, False),
+    ("activity_summary", _activity_summary, {"ix_chat_activity_chat_bucket", "ix_command_usage_chat_bucket"}, False, False),
+    ("dashboard_summary", _dashboard_summary, {"ix_chat_activity_rollup_bucket_start", "ix_command_usage_rollup_bucket_start"}, False, False),
+]
+
+
+def capture_statements(func):
+    """Run `func` and return the SELECT statements (with parameters) it sent to the database."""
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def check_plan(plan, allowed_indexes, index_only: bool, ordered: bool):
+    """Problems found in one EXPLAIN (FORMAT JSON) plan tree; empty when it's acceptable."""
+    problems = []
+    nodes = list(_walk(plan))
+    for node in nodes:
+        if node["Node Type"] == "Seq Scan":
+            problems.append(f"Seq Scan on {node.get('Relation Name')}")
+        if ordered and node["Node Type"] in SORT_NODES:
+            # The index should hand rows over already in ORDER BY order
+            problems.append(f"{node['Node Type']} on {', '.join(node.get('Sort Key', []))}")
+
+    scans = [node for node in nodes if node["Node Type"] in SCAN_NODES and node.get("Index Name") in allowed_indexes]
+    if not scans:
+        used = sorted({node["Index Name"] for node in nodes if node.get("Index Name")}) or ["none"]
+        problems.append(f"expected a scan of {' / '.join(sorted(allowed_indexes))}, used {', '.join(used)}")
+    elif index_only and not any(node["Node Type"] == "Index Only Scan" for node in scans):
+        problems.append(f"expected an Index Only Scan, got {scans[0]['Node Type']}")
+    return problems
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as conn:
+        result = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters)
+        plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def time_query(func, runs: int):
+    func()  # warm caches
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check hot-query plans against a synthetic dataset")
+    parser.add_argument("--rows", type=int, default=2000000, help="chat_history rows to load (other tables scale from it)")
+    parser.add_argument("--reuse", action="store_true", help="check against data already loaded instead of loading")
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per hot query")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    with app.app_context():
+        run_migrations()
+        sizes = table_sizes()
+        if not args.reuse:
+            if sizes["chat_history"]:
+                sys.exit("Plan-check database already has data; pass --reuse or point at an empty database")
+            print(f"Loading {args.rows:,} synthetic chat history rows...")
+            load_dataset(args.rows)
+            sizes = table_sizes()
+        print("Rows: " + ", ".join(f"{table}={count:,}" for table, count in sizes.items()))
+
+        results, failed = [], False
+        for name, func, allowed_indexes, index_only, ordered in HOT_QUERIES:
+            statements = capture_statements(func)
+            latency = time_query(func, args.runs)
+            checks = []
+            for statement, parameters in statements:
+                plan = explain(statement, parameters)
+                problems = check_plan(plan["Plan"], allowed_indexes, index_only, ordered)
+                failed = failed or bool(problems)
+                checks.append({
+                    "statement": " ".join(statement.split())[:160],
+                    "top_node": plan["Plan"]["Node Type"],
+                    "execution_ms": plan.get("Execution Time"),
+                    "problems": problems,
+                })
+            if not statements:
+                failed = True
+                checks.append({"statement": None, "problems": ["no SELECT statement was issued"]})
+            results.append({"query": name, **latency, "statements": checks})
+
+            status = "FAIL" if any(check["problems"] for check in checks) else "ok"
+            print(f"{status:4}  {name:18} median {latency['median_ms']:8.2f} ms   p95 {latency['p95_ms']:8.2f} ms")
+            for check in checks:
+                for problem in check["problems"]:
+                    print(f"        {problem}\n          in: {check['statement']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"checked_at": datetime.utcnow().isoformat(), "rows": sizes, "results": results}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from collections import OrderedDict
+from sqlalchemy.dialects.postgresql import insert
+from app import app, db
+from models import UserContext
+
+logger = logging.getLogger(__name__)
+
+# Sessions untouched for this long leave memory (the UserContext row stays) and release their prompt cache
+ROLEPLAY_IDLE_SECONDS = int(os.environ.get("ROLEPLAY_IDLE_SECONDS", 1800))
+ROLEPLAY_MAX_SESSIONS = 256
+# Users remembered as having no session, so their messages skip the DB lookup; oldest are forgotten first
+ROLEPLAY_MAX_MISSES = 4096
+# Turns persisted per session; older ones are dropped
+ROLEPLAY_MAX_TURNS = 40
+# Uncached turns allowed to pile up before an upstream-cached prefix is rebuilt to include them.
+# Prefixes held locally are rebuilt every turn (it's free), so caching kicks in as soon as the
+# persona plus history reaches PROMPT_CACHE_MIN_TOKENS.
+ROLEPLAY_RECACHE_TURNS = 8
+
+CHARACTER_MAX_LENGTH = 128  # UserContext.current_roleplay column size
+
+PERSONA_PROMPT = """You are roleplaying as {character} in a Telegram chat, speaking on the user's behalf.
+
+- Stay in character for every reply; never mention being an AI or break the fourth wall.
+- Match the character's voice, vocabulary and attitude, but keep replies chat-length.
+- Treat each new message as the next line of the ongoing conversation.
+"""
+
+
+class RoleplaySession:
+    """One user's active roleplay: the character, its turns and the cached prompt prefix."""
+
+    def __init__(self, user_id: int, character: str, turns=None):
+        self.user_id = user_id
+        self.character = character
+        self.turns = turns or []  # [{"role": "user" | "model", "text": ...}]
+        self.handle = None  # PromptHandle covering turns[:cached_turns]
+        self.cached_turns = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @property
+    def system_instruction(self):
+        return PERSONA_PROMPT.format(character=self.character)
+
+    def __repr__(self):
+        return f'<RoleplaySession {self.user_id} as {self.character!r}>'
+
+
+def _load_session(user_id: int):
+    with app.app_context():
+        context = UserContext.query.filter_by(user_id=user_id).first()
+        if context is None or not context.current_roleplay:
+            return None
+        turns = json.loads(context.conversation_context or "{}").get("turns", [])
+        return RoleplaySession(user_id, context.current_roleplay, turns)
+
+
+def _save_session(user_id: int, character, turns):
+    """Upsert the user's UserContext row in one statement; character None ends the roleplay."""
+    values = {
+        'current_roleplay': character,
+        'conversation_context': json.dumps({"turns": turns}) if character else None,
+        'last_interaction': datetime.utcnow(),
+    }
+    with app.app_context():
+        stmt = insert(UserContext).values(user_id=user_id, **values)
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id'], set_=values)
+        db.session.execute(stmt)
+        db.session.commit()
+
+
+class RoleplaySessionStore:
+    """
+    Write-through cache of roleplay sessions over UserContext.
+
+    Reads are served from memory after the first load, so a roleplay turn
+    costs no DB read; every change is written to UserContext before the call
+    returns. Idle sessions are evicted and their prompt caches released.
+    Turns run against a PromptCache so only the messages since the last
+    prefix rebuild are sent to the model.
+    """
+
+    def __init__(self, prompt_cache, idle_seconds: int = ROLEPLAY_IDLE_SECONDS, max_sessions: int = ROLEPLAY_MAX_SESSIONS):
+        self.prompt_cache = prompt_cache
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.misses = OrderedDict()  # users known to have no active session, oldest first
+
+    async def _run_db(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def get(self, user_id: int):
+        """The user's active session, or None."""
+        await self.evict_idle()
+        session = self.sessions.get(user_id)
+        if session is None:
+            if user_id in self.misses:
+                self.misses.move_to_end(user_id)
+                return None
+            session = await self._run_db(_load_session, user_id)
+            if session is None:
+                self._remember_miss(user_id)
+                return None
+            self.sessions[user_id] = session
+        self.sessions.move_to_end(user_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def start(self, user_id: int, character: str):
+        """Begin (or replace) the user's roleplay as `character`."""
+        character = character[:CHARACTER_MAX_LENGTH]
+        await self._run_db(_save_session, user_id, character, [])
+        old = self.sessions.pop(user_id, None)
+        if old is not None:
+            await self._release(old)
+        self.misses.pop(user_id, None)
+        session = RoleplaySession(user_id, character)
+        self.sessions[user_id] = session
+        await self.evict_idle()
+        return session
+
+    async def clear(self, user_id: int):
+        """End the user's roleplay and forget its conversation."""
+        await self._run_db(_save_session, user_id, None, [])
+        session = self.sessions.pop(user_id, None)
+        if session is not None:
+            await self._release(session)
+        self._remember_miss(user_id)
+
+    def _remember_miss(self, user_id: int):
+        self.misses[user_id] = True
+        self.misses.move_to_end(user_id)
+        while len(self.misses) > ROLEPLAY_MAX_MISSES:
+            self.misses.popitem(last=False)
+
+    async def reply(self, session: RoleplaySession, text: str):
+        """Answer `text` in character, sending only the turns since the cached prefix."""
+        async with session.lock:
+            if (session.handle is None or session.handle.upstream is None
+                    or len(session.turns) - session.cached_turns >= ROLEPLAY_RECACHE_TURNS):
+                await self._refresh_prefix(session)
+
+            user_turn = {"role": "user", "text": text}
+            delta = session.turns[session.cached_turns:] + [user_turn]
+            response = await self.prompt_cache.generate(session.handle, delta)
+
+            turns = session.turns + [user_turn, {"role": "model", "text": response}]
+            dropped = max(0, len(turns) - ROLEPLAY_MAX_TURNS)
+            await self._run_db(_save_session, session.user_id, session.character, turns[dropped:])
+            session.turns = turns[dropped:]
+            # The cached prefix still holds the dropped turns; only the offset moves
+            session.cached_turns = max(0, session.cached_turns - dropped)
+            session.last_used = time.monotonic()
+            return response
+
+    async def _refresh_prefix(self, session: RoleplaySession):
+        if session.handle is not None:
+            await self.prompt_cache.release(session.handle)
+        session.handle = await self.prompt_cache.open(session.system_instruction, session.turns, self.idle_seconds)
+        session.cached_turns = len(session.turns)
+
+    async def _release(self, session: RoleplaySession):
+        if session.handle is not None:
+            handle, session.handle = session.handle, None
+            await self.prompt_cache.release(handle)
+
+    async def evict_idle(self):
+        """Drop sessions idle past `idle_seconds`, and the oldest beyond `max_sessions`."""
+        now = time.monotonic()
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if now - session.last_used < self.idle_seconds and len(self.sessions) <= self.max_sessions:
+                break
+            if session.lock.locked():
+                # Mid-turn; leave it for the next sweep
+                break
+            del self.sessions[user_id]
+            await self._release(session)
+            logger.info(f"Evicted idle roleplay session for user {user_id}")
@@ -0,0 +1,133 @@
+import sys
+import time
+import builtins
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Reference point for every timing below: the moment this module was first imported,
+# which main.py does before anything else.
+BOOT_TIME = time.perf_counter()
+
+# Ordered (phase, seconds since boot at end, duration) entries of the startup sequence
+STARTUP_PHASES = []
+# First-import cost per module, in seconds, inclusive of its own imports (-X importtime "cumulative")
+IMPORT_TIMES = {}
+
+schema_ready = threading.Event()
+
+_original_import = None
+_startup_lock = threading.Lock()
+_startup_started = False
+
+
+@contextmanager
+def timed_phase(name: str):
+    """Record how long a startup phase takes."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished = time.perf_counter()
+        STARTUP_PHASES.append((name, finished - BOOT_TIME, finished - started))
+        logger.info(f"Startup phase '{name}' took {(finished - started) * 1000:.1f}ms")
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - started)
+
+
+def install_import_timer():
+    """Time first imports until uninstall_import_timer(); only meant for the boot window."""
+    global _original_import
+    if _original_import is None:
+        _original_import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+
+def uninstall_import_timer():
+    global _original_import
+    if _original_import is not None:
+        builtins.__import__ = _original_import
+        _original_import = None
+
+
+def lazy_import(module_name: str):
+    """Import a heavy module on first use, recording its import cost."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    IMPORT_TIMES.setdefault(module_name, time.perf_counter() - started)
+    return module
+
+
+def ensure_schema():
+    """One-time schema setup: create missing tables and apply pending migrations."""
+    try:
+        with timed_phase("schema"):
+            from app import initialize_database
+            initialize_database()
+    finally:
+        schema_ready.set()
+
+
+def wait_for_schema(timeout: float = 60):
+    """Block until the background schema step has finished (or timed out)."""
+    if not schema_ready.wait(timeout):
+        logger.warning("Schema setup still running; continuing anyway")
+
+
+def run_startup(background: bool = True):
+    """
+    Explicit startup sequence for the web service, run once per process.
+
+    Nothing here touches the database on the import path: the schema step runs
+    in a background thread so /health answers as soon as the app is imported.
+    """
+    global _startup_started
+    with _startup_lock:
+        if _startup_started:
+            return
+        _startup_started = True
+
+    STARTUP_PHASES.append(("app_ready", time.perf_counter() - BOOT_TIME, 0.0))
+    uninstall_import_timer()
+
+    if background:
+        threading.Thread(target=ensure_schema, name="envo-schema-setup", daemon=True).start()
+    else:
+        ensure_schema()
+
+
+def startup_report(top_imports: int = 25):
+    """Startup phases plus the slowest first imports, for the dashboard."""
+    from command_router import PLUGIN_LOAD_TIMES
+
+    slowest = sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)[:top_imports]
+    return {
+        "uptime_seconds": round(time.perf_counter() - BOOT_TIME, 3),
+        "schema_ready": schema_ready.is_set(),
+        "phases": [
+            {"phase": name, "at_ms": round(at * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+            for name, at, duration in STARTUP_PHASES
+        ],
+        "imports": [
+            {"module": name, "cumulative_ms": round(seconds * 1000, 1)}
+            for name, seconds in slowest
+        ],
+        "plugins": {
+            name: round(seconds * 1000, 1)
+            for name, seconds in PLUGIN_LOAD_TIMES.items()
+        },
+    }
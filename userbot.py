@@ -1,96 +1,137 @@
 import os
 import asyncio
 import logging
-from datetime import datetime
+import functools
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from app import app, db
-from models import ChatHistory
 from gemini_client import GeminiClient
-from utils import transcribe_voice, analyze_image, format_error_message
+from utils import format_error_message
+from command_router import CommandRouter, load_plugin
+from analytics import record_command
+from ingest import HistoryWriter, history_row_from_message
+from accounts import DEFAULT_ACCOUNT_ID, AccountBudget
+from sessions import RoleplaySessionStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONTENT_COMMANDS = ["summarize", "translate", "rewrite", "improve", "expand", "condense"]
+ANALYSIS_COMMANDS = ["analyze", "explain"]
+
 class UserbotManager:
-    def __init__(self):
+    def __init__(self, account_id: str = DEFAULT_ACCOUNT_ID, session_string: str = None,
+                 gemini: GeminiClient = None, budget: AccountBudget = None):
         self.client = None
         self.is_running = False
-        self.gemini = GeminiClient()
+        self.account_id = account_id
+        self.session_string = session_string
+        # Shared across accounts when hosted by MultiAccountHost
+        self.gemini = gemini or GeminiClient()
+        self.budget = budget or AccountBudget()
+        self.router = self.build_router()
+        self.history_writer = HistoryWriter()
+        self.roleplay = RoleplaySessionStore(self.gemini.prompt_cache)
+        self.backfill_task = None
 
     async def initialize_client(self):
         """Initialize Pyrogram client"""
-        session_string = os.environ.get("TELEGRAM_SESSION_STRING")
+        session_string = self.session_string or os.environ.get("TELEGRAM_SESSION_STRING")
         if not session_string:
-            raise ValueError("Missing TELEGRAM_SESSION_STRING in environment variables")
-        self.client = Client("envo_userbot", session_string=session_string)
+            raise ValueError(f"Missing session string for account '{self.account_id}'")
+        client_name = "envo_userbot" if self.account_id == DEFAULT_ACCOUNT_ID else f"envo_userbot_{self.account_id}"
+        self.client = Client(client_name, session_string=session_string)
         self.register_handlers()
 
+    def build_router(self):
+        """Build the command dispatch table"""
+        router = CommandRouter(self)
+        router.register("envo", self.process_ask_command)
+
+        # --- Content Creation & Editing ---
+        for command_type in CONTENT_COMMANDS:
+            router.register(command_type, functools.partial(self.process_content_command, command_type=command_type))
+
+        # --- Analysis & Search ---
+        for command_type in ANALYSIS_COMMANDS:
+            router.register(command_type, functools.partial(self.process_analysis_command, command_type=command_type))
+        router.register_lazy("search", "search", "process_search_command")
+
+        # --- Roleplay ---
+        router.register_lazy("roleplay", "roleplay", "process_roleplay_command")
+        router.register_lazy("clear", "roleplay", "process_clear_command")
+
+        # --- Utility ---
+        router.register("help", self.process_help_command)
+        router.register("pass", lambda message: message.delete())
+        return router
+
     def register_handlers(self):
         """Register message handlers"""
-        @self.client.on_message(filters.me & filters.command("envo", prefixes="."))
-        async def handle_ask_command(client, message: Message):
-            await self.process_ask_command(message)
-
-        # --- Content Creation & Editing Handlers ---
-        @self.client.on_message(filters.me & filters.command("summarize", prefixes="."))
-        async def handle_summarize_command(client, message: Message):
-            await self.process_content_command(message, "summarize")
-
-        @self.client.on_message(filters.me & filters.command("translate", prefixes="."))
-        async def handle_translate_command(client, message: Message):
-            await self.process_content_command(message, "translate")
-
-        @self.client.on_message(filters.me & filters.command("rewrite", prefixes="."))
-        async def handle_rewrite_command(client, message: Message):
-            await self.process_content_command(message, "rewrite")
-
-        @self.client.on_message(filters.me & filters.command("improve", prefixes="."))
-        async def handle_improve_command(client, message: Message):
-            await self.process_content_command(message, "improve")
-
-        @self.client.on_message(filters.me & filters.command("expand", prefixes="."))
-        async def handle_expand_command(client, message: Message):
-            await self.process_content_command(message, "expand")
-
-        @self.client.on_message(filters.me & filters.command("condense", prefixes="."))
-        async def handle_condense_command(client, message: Message):
-            await self.process_content_command(message, "condense")
-
-        # --- Analysis & Search Handlers ---
-        @self.client.on_message(filters.me & filters.command("analyze", prefixes="."))
-        async def handle_analyze_command(client, message: Message):
-            await self.process_analysis_command(message, "analyze")
-
-        @self.client.on_message(filters.me & filters.command("explain", prefixes="."))
-        async def handle_explain_command(client, message: Message):
-            await self.process_analysis_command(message, "explain")
-
-        # --- Utility Handlers ---
-        @self.client.on_message(filters.me & filters.command("help", prefixes="."))
-        async def handle_help_command(client, message: Message):
-            await self.process_help_command(message)
-
-        @self.client.on_message(filters.me & filters.command("pass", prefixes="."))
-        async def handle_pass_command(client, message: Message):
-            await message.delete()
+        @self.client.on_message(filters.me)
+        async def handle_own_message(client, message: Message):
+            await self.dispatch_command(message)
 
         @self.client.on_message(~filters.me & ~filters.bot)
         async def store_message(client, message: Message):
             await self.store_chat_history(message)
 
+        @self.client.on_edited_message(~filters.me & ~filters.bot)
+        async def store_edited_message(client, message: Message):
+            await self.store_chat_history(message)
+
+        @self.client.on_deleted_messages()
+        async def handle_deleted_messages(client, messages):
+            await self.mark_messages_deleted(messages)
+
+    async def dispatch_command(self, message: Message):
+        """Route an outgoing message to its command handler, if it is a command"""
+        route = self.router.resolve(message)
+        if route is None:
+            return
+        command, handler = route
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, record_command, self.account_id, message.chat.id, command)
+        await self.run_budgeted(handler(message))
+
     async def start(self):
         """Start the userbot"""
         try:
             await self.initialize_client()
             await self.client.start()
             self.is_running = True
-            logger.info("Envo userbot started successfully")
+            self.history_writer.start()
+            logger.info(f"Envo userbot started successfully for account '{self.account_id}'")
+            backfill_chats = os.environ.get("BACKFILL_CHATS")
+            if backfill_chats:
+                from backfill import chats_for_account
+                chat_refs = chats_for_account(backfill_chats, self.account_id)
+                if chat_refs:
+                    # Keep a reference so the running task isn't garbage-collected
+                    self.backfill_task = asyncio.create_task(self.run_backfill(chat_refs))
             await asyncio.Event().wait()
         except Exception as e:
-            logger.error(f"Failed to start userbot: {e}")
+            logger.error(f"Failed to start userbot for account '{self.account_id}': {e}")
             self.is_running = False
+        finally:
+            if self.backfill_task is not None and not self.backfill_task.done():
+                self.backfill_task.cancel()
+            # Also runs on cancellation (shutdown), so buffered messages aren't lost
+            await self.history_writer.stop()
+
+    async def run_budgeted(self, coro):
+        """Run a command coroutine within this account's concurrency and rate budget."""
+        async with self.budget:
+            await coro
+
+    async def run_backfill(self, chat_refs):
+        """Backfill the given chats' history in the background (BACKFILL_CHATS mode)."""
+        from backfill import Backfiller
+        try:
+            backfiller = Backfiller(self.client, account_id=self.account_id)
+            await backfiller.run(chat_refs)
+        except Exception as e:
+            logger.error(f"Background backfill failed: {e}", exc_info=True)
 
     async def process_ask_command(self, message: Message):
         """Process .envo command, prioritizing replied-to content."""
@@ -103,30 +144,26 @@ class UserbotManager:
                 if reply_msg.text:
                     replied_content = reply_msg.text
                 elif reply_msg.photo:
-                    try:
-                        photo_path = await self.client.download_media(reply_msg.photo)
-                        replied_content = f"Image content: {await analyze_image(photo_path)}"
-                        os.remove(photo_path)
-                    except Exception as e:
-                        logger.error(f"Image analysis error: {e}")
-                        replied_content = "Image: Could not analyze"
+                    replied_content = await load_plugin("vision").describe_photo(self, reply_msg)
                 elif reply_msg.voice:
-                    try:
-                        voice_path = await self.client.download_media(reply_msg.voice)
-                        replied_content = f"Voice message transcription: {await transcribe_voice(voice_path)}"
-                        os.remove(voice_path)
-                    except Exception as e:
-                        logger.error(f"Voice transcription error: {e}")
-                        replied_content = "Voice: Could not transcribe"
+                    replied_content = await load_plugin("voice").describe_voice(self, reply_msg)
 
             if not question and replied_content:
                 question = "What do you think about this?"
 
+            session = await self.roleplay.get(message.from_user.id) if message.from_user else None
+            if session:
+                turn = f"{question}\n\n(Replying to: {replied_content})" if replied_content else (question or "Say something in character.")
+                response = await self.roleplay.reply(session, turn)
+                await message.edit_text(response or "...")
+                return
+
             # --- FIX: Changed 'replied_content' to 'context' ---
             response = await self.gemini.generate_response(
                 question=question,
                 context=replied_content,
-                chat_id=message.chat.id
+                chat_id=message.chat.id,
+                account_id=self.account_id
             )
 
             await message.edit_text(response)
@@ -229,24 +266,19 @@ class UserbotManager:
         return None
     
     async def store_chat_history(self, message: Message):
-        """Store message in chat history for context"""
+        """Queue a new or edited message for the batched chat history upsert"""
         if message.text and message.text.startswith('.'):
             return
         try:
-            # Use app_context to interact with the database
-            with app.app_context():
-                chat_history = ChatHistory(
-                    chat_id=message.chat.id,
-                    message_id=message.id,
-                    user_id=message.from_user.id if message.from_user else None,
-                    username=message.from_user.username if message.from_user else None,
-                    first_name=message.from_user.first_name if message.from_user else None,
-                    last_name=message.from_user.last_name if message.from_user else None,
-                    message_text=message.text,
-                    message_type='text' if message.text else 'other',
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(chat_history)
-                db.session.commit()
+            await self.history_writer.add(history_row_from_message(message, self.account_id))
         except Exception as e:
             logger.error(f"Error storing chat history: {e}")
+
+    async def mark_messages_deleted(self, messages):
+        """Flag deleted messages in chat history, grouped by chat"""
+        by_chat = {}
+        for message in messages:
+            chat_id = message.chat.id if message.chat else None
+            by_chat.setdefault(chat_id, []).append(message.id)
+        for chat_id, message_ids in by_chat.items():
+            await self.history_writer.delete(self.account_id, message_ids, chat_id=chat_id)
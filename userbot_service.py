@@ -2,23 +2,30 @@
 """
 Standalone Userbot Service for Envo
 This runs the Telegram userbot as a separate service from the Flask web app.
+
+Every account in TELEGRAM_SESSION_STRINGS (or the single TELEGRAM_SESSION_STRING)
+is hosted in one process. Use --shard-index/--shard-count to run a subset of
+accounts per process, or --processes N to fork N sharded workers from here.
 """
 
 import os
 import sys
+import signal
 import asyncio
 import logging
+import argparse
+import multiprocessing
 from pathlib import Path
 
 # Ensure we're working in the correct directory
 os.chdir(Path(__file__).parent)
 
 try:
-    from userbot import UserbotManager
+    from accounts import MultiAccountHost, load_accounts
 except ImportError:
     # Add current directory to path if import fails
     sys.path.insert(0, str(Path(__file__).parent))
-    from userbot import UserbotManager
+    from accounts import MultiAccountHost, load_accounts
 
 # Set up logging
 logging.basicConfig(
@@ -27,40 +34,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
+async def main(shard_index: int = 0, shard_count: int = 1):
     """Main function to run the userbot service"""
     
     # Check for required environment variables
-    session_string = os.environ.get("TELEGRAM_SESSION_STRING")
     gemini_key = os.environ.get("GEMINI_API_KEY")
     
-    if not session_string:
-        logger.error("TELEGRAM_SESSION_STRING environment variable is required")
+    if not load_accounts():
+        logger.error("TELEGRAM_SESSION_STRINGS or TELEGRAM_SESSION_STRING environment variable is required")
         sys.exit(1)
     
     if not gemini_key:
         logger.error("GEMINI_API_KEY environment variable is required")
         sys.exit(1)
     
-    logger.info("Starting Envo Telegram Userbot Service...")
+    logger.info(f"Starting Envo Telegram Userbot Service (shard {shard_index + 1}/{shard_count})...")
     
     try:
-        # Initialize and start the userbot
-        userbot_manager = UserbotManager()
-        await userbot_manager.start()
+        # This service can start before the web app has ever run, so make sure the schema exists
+        import startup
+        startup.run_startup(background=False)
+
+        # Initialize and start the userbot(s)
+        host = MultiAccountHost(shard_index=shard_index, shard_count=shard_count)
+        # Turn SIGTERM (container stop/redeploy) into cancellation so buffered history is flushed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await host.start()
         
-    except KeyboardInterrupt:
-        logger.info("Userbot service stopped by user")
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Userbot service stopped")
     except Exception as e:
         logger.error(f"Userbot service error: {e}")
         sys.exit(1)
 
+def run_shard(shard_index: int, shard_count: int):
+    """Entry point for one sharded worker process"""
+    try:
+        asyncio.run(main(shard_index, shard_count))
+    except KeyboardInterrupt:
+        logger.info("Service interrupted")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Envo Telegram userbot service")
+    parser.add_argument("--shard-index", type=int, default=int(os.environ.get("SHARD_INDEX", 0)))
+    parser.add_argument("--shard-count", type=int, default=int(os.environ.get("SHARD_COUNT", 1)))
+    parser.add_argument("--processes", type=int, default=1, help="Fork this many sharded worker processes")
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        # Migrate once here, before any worker starts, so workers never race on the schema
+        import startup
+        from app import app, db
+        startup.run_startup(background=False)
+        # Forked workers must not share the parent's pooled connections (one socket, N processes)
+        with app.app_context():
+            db.engine.dispose()
+        workers = [
+            multiprocessing.Process(target=run_shard, args=(index, args.processes), name=f"envo-shard-{index}")
+            for index in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+
+        def forward_sigterm(signum, frame):
+            # Each worker turns SIGTERM into cancellation and flushes its buffered history
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, forward_sigterm)
+        for worker in workers:
+            worker.join()
+        sys.exit(0)
+
     # Run the userbot service
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.shard_index, args.shard_count))
     except KeyboardInterrupt:
         logger.info("Service interrupted")
     except Exception as e:
         logger.error(f"Service failed: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -1,71 +1,30 @@
-import os
 import logging
-import asyncio
-import speech_recognition as sr
-from PIL import Image
-from app import app
+from app import app, db
 from models import ChatHistory
+from accounts import DEFAULT_ACCOUNT_ID
 
 logger = logging.getLogger(__name__)
 
-async def transcribe_voice(voice_path: str):
-    """Transcribe voice message to text"""
-    try:
-        # Run transcription in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _transcribe_sync, voice_path)
-    except Exception as e:
-        logger.error(f"Voice transcription error: {e}")
-        return "Could not transcribe voice message"
-
-def _transcribe_sync(voice_path: str):
-    """Synchronous voice transcription"""
-    try:
-        recognizer = sr.Recognizer()
-        
-        # Convert to WAV if needed (speech_recognition works better with WAV)
-        with sr.AudioFile(voice_path) as source:
-            audio = recognizer.record(source)
-            
-        # Try Google Speech Recognition
-        try:
-            text = recognizer.recognize_google(audio)
-            return text
-        except sr.UnknownValueError:
-            return "Could not understand audio"
-        except sr.RequestError:
-            # Fallback to other recognition methods
-            try:
-                text = recognizer.recognize_sphinx(audio)
-                return text
-            except:
-                return "Speech recognition service unavailable"
-                
-    except Exception as e:
-        logger.error(f"Sync transcription error: {e}")
-        return "Error transcribing audio"
-
-async def analyze_image(image_path: str):
-    """Analyze image and extract text"""
-    try:
-        # Import here to avoid circular imports
-        from gemini_client import GeminiClient
-        
-        gemini = GeminiClient()
-        analysis = await gemini.analyze_image(image_path)
-        return analysis
-        
-    except Exception as e:
-        logger.error(f"Image analysis error: {e}")
-        return "Could not analyze image"
-
-async def get_chat_context(chat_id: int, limit: int = 10):
+async def get_chat_context(chat_id: int, limit: int = 10, account_id: str = DEFAULT_ACCOUNT_ID):
     """Get recent chat context for AI responses"""
     try:
         with app.app_context():
-            recent_messages = ChatHistory.query.filter_by(chat_id=chat_id).order_by(
+            recent_messages = ChatHistory.query.filter(
+                ChatHistory.account_id == account_id,
+                ChatHistory.chat_id == chat_id,
+                ChatHistory.is_deleted.is_(False),
+                ChatHistory.message_text.isnot(None),
+            ).order_by(
                 ChatHistory.timestamp.desc()
             ).limit(limit).all()
+
+            if len(recent_messages) < limit:
+                # Hot table ran short; continue into the cold archive
+                from archive import read_recent_archived
+                recent_messages += read_recent_archived(
+                    chat_id, limit - len(recent_messages), account_id=account_id,
+                    before=recent_messages[-1].timestamp if recent_messages else None,
+                )
             
             if not recent_messages:
                 return None
@@ -128,15 +87,15 @@ async def check_rate_limit(user_id: int, chat_id: int):
         return True, None  # Allow on error
 
 def clean_old_data():
-    """Clean old chat history and command queue data"""
+    """Archive aged chat history and clean old command queue data"""
     try:
         from datetime import datetime, timedelta
+        from archive import archive_old_history
+        
+        # Move chat history older than 30 days into compressed cold segments
+        archive_old_history()
         
         with app.app_context():
-            # Delete chat history older than 30 days
-            old_date = datetime.utcnow() - timedelta(days=30)
-            ChatHistory.query.filter(ChatHistory.timestamp < old_date).delete()
-            
             # Delete completed command queue entries older than 1 day
             queue_old_date = datetime.utcnow() - timedelta(days=1)
             from models import CommandQueue